@@ -8,9 +8,21 @@ EMPTY_MASTERS   = False                          # Display (True) or not (False)
 #
 HBLINK_IP       = '127.0.0.1'                    # HBlink's IP Address
 HBLINK_PORT     = 4321                           # HBlink's TCP reporting socket
+RELAY_URL       = ''                             # Mirror another monitor instead of HBlink, e.g. 'ws://10.0.0.1:9000', '' to disable
+RELAY_TOKEN     = ''                             # Shared secret relays send for the state feed (and sent to RELAY_URL), '' serves no feed
 FREQUENCY       = 10                             # Frequency to push updates to web clients
 WEB_SERVER_PORT = 8080                           # Has to be above 1024 if you're not running as root
+DASHBOARD_PORT  = 9000                           # Websocket port the browsers (and relays) connect to
 CLIENT_TIMEOUT  = 0                              # Clients are timed out after this many seconds, 0 to disable
+REPLAY_SIZE     = 500                            # Number of recent frames kept so reconnecting clients get only what they missed
+RENDER_WORKERS  = 2                              # Processes rendering the dashboard tables, 0 renders on the main thread
+
+# Peer link health history (up, pings, lost pings, connects) served as JSON on /health
+# Memory is fixed, about 8 bytes per peer for every slot kept
+LINK_HISTORY         = True
+LINK_HISTORY_RAW     = 60                       # Raw CONFIG_SND samples kept (an hour at HBlink's 60 s REPORT_INTERVAL)
+LINK_HISTORY_MINUTES = 720                      # 1 minute rollups kept (12 hours)
+LINK_HISTORY_HOURS   = 720                      # 1 hour rollups kept (30 days)
 
 # Put list of NETWORK_ID from OPB links to don't show local traffic in lastheard, for example: "260210,260211,260212"
 OPB_FILTER = ""
@@ -30,7 +42,15 @@ LOCAL_PEER_FILE = 'local_peer_ids.json'          # User provided (optional, leav
 FILE_RELOAD     = 30                              # Number of days before we reload DMR-MARC database files
 PEER_URL        = 'https://database.radioid.net/static/rptrs.json'
 SUBSCRIBER_URL  = 'https://database.radioid.net/static/users.json'
+SEARCH_LIMIT    = 50                             # Max results of a subscriber search (/search?q=SP2ABC)
+
+# Dashboard state saved periodically and restored at startup (warm start)
+SNAPSHOT_FILE     = 'hbmon_state.pickle'         # Saved in PATH
+SNAPSHOT_INTERVAL = 60                           # Seconds between saves, 0 to disable
 
 # Settings for log files
 LOG_PATH        = './log/'                       # MUST END IN '/'
 LOG_NAME        = 'hbmon.log'
+LOG_QUEUE_SIZE  = 10000                          # Log records waiting for the writer thread, extra records are dropped
+LOG_RATE_LIMIT  = 20                             # Max bridge/link event and web request log lines per second, each, 0 for no limit
+LOG_SAMPLE      = 1                              # Log 1 of every N of those lines, 1 logs them all
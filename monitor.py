@@ -34,30 +34,42 @@ import datetime
 
 import os
 import csv
-from itertools import islice
+import json
+from array import array
+from bisect import bisect_left
+from logging.handlers import QueueHandler, QueueListener
+from queue import Queue, Full
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from itertools import islice, repeat
+from operator import add
 from subprocess import check_call, CalledProcessError
 
 # Twisted modules
 from twisted.internet.protocol import ReconnectingClientFactory, Protocol
 from twisted.protocols.basic import NetstringReceiver
-from twisted.internet import reactor, task
+from twisted.internet import reactor, task, threads
 from twisted.web.server import Site
 from twisted.web.resource import Resource
 import base64
+from hmac import compare_digest
+from urllib.parse import quote
 
 # Autobahn provides websocket service under Twisted
 from autobahn.twisted.websocket import WebSocketServerProtocol, WebSocketServerFactory
+from autobahn.twisted.websocket import WebSocketClientProtocol, WebSocketClientFactory, connectWS
+from autobahn.websocket.types import ConnectionDeny
 
 # Specific functions to import from standard modules
 from time import time, strftime, localtime
-from pickle import loads
+from pickle import loads, dumps, HIGHEST_PROTOCOL, UnpicklingError
 from binascii import b2a_hex as h
 from os.path import getmtime
 from collections import deque
 from time import time
 
 # Web templating environment
-from jinja2 import Environment, PackageLoader, select_autoescape
+from jinja2 import Environment, PackageLoader, select_autoescape, TemplateNotFound
 
 # Utilities from K0USY Group sister project
 from dmr_utils3.utils import int_id, get_alias, try_download, mk_full_id_dict, bytes_4
@@ -65,6 +77,13 @@ from dmr_utils3.utils import int_id, get_alias, try_download, mk_full_id_dict, b
 # Configuration variables and constants
 from config import *
 
+# Defaults for settings added after older config.py files were written, see config_SAMPLE.py
+for _setting, _default in (('RELAY_URL', ''), ('RELAY_TOKEN', ''), ('DASHBOARD_PORT', 9000), ('REPLAY_SIZE', 500), ('RENDER_WORKERS', 2),
+                           ('LINK_HISTORY', True), ('LINK_HISTORY_RAW', 60), ('LINK_HISTORY_MINUTES', 720), ('LINK_HISTORY_HOURS', 720),
+                           ('SEARCH_LIMIT', 50), ('SNAPSHOT_FILE', 'hbmon_state.pickle'), ('SNAPSHOT_INTERVAL', 60),
+                           ('LOG_QUEUE_SIZE', 10000), ('LOG_RATE_LIMIT', 20), ('LOG_SAMPLE', 1)):
+    globals().setdefault(_setting, _default)
+
 # SP2ONG - Increase the value if HBlink link break occurs
 NetstringReceiver.MAX_LENGTH = 500000
 
@@ -82,13 +101,24 @@ OPCODE = {
 
 # Global Variables:
 CONFIG      = {}
-CTABLE      = {'MASTERS': {}, 'PEERS': {}, 'OPENBRIDGES': {}, 'SETUP': {}}
+CTABLE      = {'MASTERS': {}, 'PEERS': {}, 'OPENBRIDGES': {}, 'SETUP': {}, 'VERSION': 0}
 BRIDGES     = {}
 BTABLE      = {}
 BTABLE['BRIDGES'] = {}
+BTABLE['VERSION'] = 0
 BRIDGES_RX  = ''
 CONFIG_RX   = ''
 LOGBUF      = deque(100*[''], 100)
+RENDERED    = {}
+FRAGMENTS   = {'*': 0}
+FRAGMENT_HTML = {}
+SENT        = {'d': None, 'b': None}
+SAVED       = None
+RENDERING   = {}
+HEARD       = {}
+SEARCH_INDEX = ([], [])
+HEALTH      = None
+RENDER_POOL = None
 RED         = 'ff6600'
 BLACK       = '000000'
 GREEN       = '90EE90'
@@ -101,6 +131,7 @@ YELLOW      = 'fffccd'
 
 # Define setup setings
 CTABLE['SETUP']['LASTHEARD'] = LASTHEARD_INC
+CTABLE['SETUP']['STALE'] = False
 
 # OPB Filter for lastheard
 def get_opbf():
@@ -153,28 +184,12 @@ def alias_tgid(_id, _dict):
     else:
         return str(alias)
 
-# Return friendly elapsed time from time in seconds.
-def since(_time):
-    now = int(time())
-    _time = now - int(_time)
-    seconds = _time % 60
-    minutes = int(_time/60) % 60
-    hours = int(_time/60/60) % 24
-    days = int(_time/60/60/24)
-    if days:
-        return '{}d {}h'.format(days, hours)
-    elif hours:
-        return '{}h {}m'.format(hours, minutes)
-    elif minutes:
-        return '{}m {}s'.format(minutes, seconds)
-    else:
-        return '{}s'.format(seconds)
-
 def cleanTE():
 ##################################################
 # Cleaning entries in tables - Timeout (5 min) 
 #
     timeout = datetime.datetime.now().timestamp()
+    changed = set()
 
     for system in CTABLE['MASTERS']:
         for peer in CTABLE['MASTERS'][system]['PEERS']:
@@ -184,6 +199,7 @@ def cleanTE():
                 td = ts - timeout if ts > timeout else timeout - ts
                 td = int(round(abs((td)) / 60))
                 if td > 3:
+                    changed.add(('MASTER', system))
                     CTABLE['MASTERS'][system]['PEERS'][peer][timeS]['TS'] = False
                     CTABLE['MASTERS'][system]['PEERS'][peer][timeS]['COLOR'] = BLACK
                     CTABLE['MASTERS'][system]['PEERS'][peer][timeS]['BGCOLOR'] = WHITE2
@@ -199,6 +215,7 @@ def cleanTE():
               td = ts - timeout if ts > timeout else timeout - ts
               td = int(round(abs((td)) / 60))
               if td > 3:
+                 changed.add('PEERS')
                  CTABLE['PEERS'][system][timeS]['TS'] = False
                  CTABLE['PEERS'][system][timeS]['COLOR'] = BLACK
                  CTABLE['PEERS'][system][timeS]['BGCOLOR'] = WHITE2
@@ -213,8 +230,11 @@ def cleanTE():
             td = ts - timeout if ts > timeout else timeout - ts
             td = int(round(abs((td)) / 60))
             if td > 3:
+                 changed.add(('OPENBRIDGE', system))
                  del CTABLE['OPENBRIDGES'][system]['STREAMS'][streamId]
 
+    if changed:
+        table_changed(*changed)
                     
 def add_hb_peer(_peer_conf, _ctable_loc, _peer):
     _ctable_loc[int_id(_peer)] = {}
@@ -272,7 +292,8 @@ def add_hb_peer(_peer_conf, _ctable_loc, _peer):
        _ctable_peer['COLORCODE'] = _peer_conf['COLORCODE']
     
     _ctable_peer['CONNECTION'] = _peer_conf['CONNECTION']
-    _ctable_peer['CONNECTED'] = since(_peer_conf['CONNECTED'])
+    # Connection start as a timestamp, the browser shows the elapsed time
+    _ctable_peer['CONNECTED'] = int(_peer_conf['CONNECTED'])
     _ctable_peer['IP'] = _peer_conf['IP']
     _ctable_peer['PORT'] = _peer_conf['PORT']
     #_ctable_peer['LAST_PING'] = _peer_conf['LAST_PING']
@@ -330,7 +351,7 @@ def build_hblink_table(_config, _stats_table):
                 if _stats_table['PEERS'][_hbp]['MODE'] == 'XLXPEER': 
                     _stats_table['PEERS'][_hbp]['STATS']['CONNECTION'] = _hbp_data['XLXSTATS']['CONNECTION']
                     if _hbp_data['XLXSTATS']['CONNECTION'] == "YES":
-                        _stats_table['PEERS'][_hbp]['STATS']['CONNECTED'] = since(_hbp_data['XLXSTATS']['CONNECTED'])
+                        _stats_table['PEERS'][_hbp]['STATS']['CONNECTED'] = int(_hbp_data['XLXSTATS']['CONNECTED'])
                         _stats_table['PEERS'][_hbp]['STATS']['PINGS_SENT'] = _hbp_data['XLXSTATS']['PINGS_SENT']
                         _stats_table['PEERS'][_hbp]['STATS']['PINGS_ACKD'] = _hbp_data['XLXSTATS']['PINGS_ACKD']
                     else:
@@ -340,7 +361,7 @@ def build_hblink_table(_config, _stats_table):
                 else:
                     _stats_table['PEERS'][_hbp]['STATS']['CONNECTION'] = _hbp_data['STATS']['CONNECTION']
                     if _hbp_data['STATS']['CONNECTION'] == "YES":
-                        _stats_table['PEERS'][_hbp]['STATS']['CONNECTED'] = since(_hbp_data['STATS']['CONNECTED'])
+                        _stats_table['PEERS'][_hbp]['STATS']['CONNECTED'] = int(_hbp_data['STATS']['CONNECTED'])
                         _stats_table['PEERS'][_hbp]['STATS']['PINGS_SENT'] = _hbp_data['STATS']['PINGS_SENT']
                         _stats_table['PEERS'][_hbp]['STATS']['PINGS_ACKD'] = _hbp_data['STATS']['PINGS_ACKD']
                     else:
@@ -376,16 +397,45 @@ def build_hblink_table(_config, _stats_table):
                 _stats_table['OPENBRIDGES'][_hbp]['TARGET_PORT'] = _hbp_data['TARGET_PORT']
                 _stats_table['OPENBRIDGES'][_hbp]['STREAMS'] = {}
 
+    table_changed('*')
     #return(_stats_table)
 
 def update_hblink_table(_config, _stats_table):
+    changed = set()
+    removed = False
+
+    # Systems removed from or added to HBlink's config since the table was built (e.g. restored from a snapshot)
+    for _section in ('MASTERS', 'PEERS', 'OPENBRIDGES'):
+        for _hbp in list(_stats_table[_section]):
+            if _hbp not in _config or _config[_hbp]['ENABLED'] != True:
+                logger.info('Deleting system not in hblink config: %s', _hbp)
+                del _stats_table[_section][_hbp]
+                removed = True
+                # The page is assembled again without it, only the peer systems section is one fragment
+                if _section == 'PEERS':
+                    changed.add('PEERS')
+                else:
+                    FRAGMENTS.pop((_section[:-1], _hbp), None)
+
+    _new_systems = {}
+    for _hbp, _hbp_data in _config.items():
+        if _hbp in _stats_table['MASTERS'] or _hbp in _stats_table['PEERS'] or _hbp in _stats_table['OPENBRIDGES']:
+            continue
+        # Disabled systems are never in the table, they are not new
+        if (_hbp_data['MODE'] in ('MASTER', 'OPENBRIDGE') or (_hbp_data['MODE'] in ('PEER', 'XLXPEER') and HOMEBREW_INC)) and _hbp_data['ENABLED'] == True:
+            _new_systems[_hbp] = _hbp_data
+    if _new_systems:
+        logger.info('Adding systems to CTABLE: %s', ', '.join(_new_systems))
+        build_hblink_table(_new_systems, _stats_table)
+
     # Is there a system in HBlink's config monitor doesn't know about?
     for _hbp in _config:
-        if _config[_hbp]['MODE'] == 'MASTER':
+        if _config[_hbp]['MODE'] == 'MASTER' and _hbp in _stats_table['MASTERS']:
             for _peer in _config[_hbp]['PEERS']:
                 if int_id(_peer) not in _stats_table['MASTERS'][_hbp]['PEERS'] and _config[_hbp]['PEERS'][_peer]['CONNECTION'] == 'YES':
                     logger.info('Adding peer to CTABLE that has registerred: %s', int_id(_peer))
                     add_hb_peer(_config[_hbp]['PEERS'][_peer], _stats_table['MASTERS'][_hbp]['PEERS'], _peer)
+                    changed.add(('MASTER', _hbp))
 
     # Is there a system in monitor that's been removed from HBlink's config?
     for _hbp in _stats_table['MASTERS']:
@@ -398,37 +448,37 @@ def update_hblink_table(_config, _stats_table):
             for _peer in remove_list:
                 logger.info('Deleting stats peer not in hblink config: %s', _peer)
                 del (_stats_table['MASTERS'][_hbp]['PEERS'][_peer])
+                changed.add(('MASTER', _hbp))
 
     # Update connection time
     for _hbp in _stats_table['MASTERS']:
         for _peer in _stats_table['MASTERS'][_hbp]['PEERS']:
             if bytes_4(_peer) in _config[_hbp]['PEERS']:
-                _stats_table['MASTERS'][_hbp]['PEERS'][_peer]['CONNECTED'] = since(_config[_hbp]['PEERS'][bytes_4(_peer)]['CONNECTED'])
+                _connected = int(_config[_hbp]['PEERS'][bytes_4(_peer)]['CONNECTED'])
+                if _stats_table['MASTERS'][_hbp]['PEERS'][_peer]['CONNECTED'] != _connected:
+                    _stats_table['MASTERS'][_hbp]['PEERS'][_peer]['CONNECTED'] = _connected
+                    changed.add(('MASTER', _hbp))
 
     for _hbp in _stats_table['PEERS']:
         if _stats_table['PEERS'][_hbp]['MODE'] == 'XLXPEER':
-            if _config[_hbp]['XLXSTATS']['CONNECTION'] == "YES":
-                _stats_table['PEERS'][_hbp]['STATS']['CONNECTED'] = since(_config[_hbp]['XLXSTATS']['CONNECTED'])
-                _stats_table['PEERS'][_hbp]['STATS']['CONNECTION'] = _config[_hbp]['XLXSTATS']['CONNECTION']
-                _stats_table['PEERS'][_hbp]['STATS']['PINGS_SENT'] = _config[_hbp]['XLXSTATS']['PINGS_SENT']
-                _stats_table['PEERS'][_hbp]['STATS']['PINGS_ACKD'] = _config[_hbp]['XLXSTATS']['PINGS_ACKD']
-            else:
-                _stats_table['PEERS'][_hbp]['STATS']['CONNECTED'] = "--   --"
-                _stats_table['PEERS'][_hbp]['STATS']['CONNECTION'] = _config[_hbp]['XLXSTATS']['CONNECTION']
-                _stats_table['PEERS'][_hbp]['STATS']['PINGS_SENT'] = 0
-                _stats_table['PEERS'][_hbp]['STATS']['PINGS_ACKD'] = 0
+            _hbp_stats = _config[_hbp]['XLXSTATS']
         else:
-            if _config[_hbp]['STATS']['CONNECTION'] == "YES":
-                _stats_table['PEERS'][_hbp]['STATS']['CONNECTED'] = since(_config[_hbp]['STATS']['CONNECTED'])
-                _stats_table['PEERS'][_hbp]['STATS']['CONNECTION'] = _config[_hbp]['STATS']['CONNECTION']
-                _stats_table['PEERS'][_hbp]['STATS']['PINGS_SENT'] = _config[_hbp]['STATS']['PINGS_SENT']
-                _stats_table['PEERS'][_hbp]['STATS']['PINGS_ACKD'] = _config[_hbp]['STATS']['PINGS_ACKD']
-            else:
-                _stats_table['PEERS'][_hbp]['STATS']['CONNECTED'] = "--   --"
-                _stats_table['PEERS'][_hbp]['STATS']['CONNECTION'] = _config[_hbp]['STATS']['CONNECTION']
-                _stats_table['PEERS'][_hbp]['STATS']['PINGS_SENT'] = 0
-                _stats_table['PEERS'][_hbp]['STATS']['PINGS_ACKD'] = 0
-    
+            _hbp_stats = _config[_hbp]['STATS']
+        _stats = {'CONNECTION': _hbp_stats['CONNECTION']}
+        if _hbp_stats['CONNECTION'] == "YES":
+            _stats['CONNECTED'] = int(_hbp_stats['CONNECTED'])
+            _stats['PINGS_SENT'] = _hbp_stats['PINGS_SENT']
+            _stats['PINGS_ACKD'] = _hbp_stats['PINGS_ACKD']
+        else:
+            _stats['CONNECTED'] = "--   --"
+            _stats['PINGS_SENT'] = 0
+            _stats['PINGS_ACKD'] = 0
+        if _stats_table['PEERS'][_hbp]['STATS'] != _stats:
+            _stats_table['PEERS'][_hbp]['STATS'] = _stats
+            changed.add('PEERS')
+
+    if changed or removed:
+        table_changed(*changed)
     cleanTE()
     build_stats()
 
@@ -439,8 +489,6 @@ def update_hblink_table(_config, _stats_table):
 
 def build_bridge_table(_bridges):
     _stats_table = {}
-    _now = time()
-    _cnow = strftime('%Y-%m-%d %H:%M:%S', localtime(_now))
 
     for _bridge, _bridge_data in list(_bridges.items()):
         _stats_table[_bridge] = {}
@@ -450,11 +498,9 @@ def build_bridge_table(_bridges):
             _stats_table[_bridge][system['SYSTEM']]['TS'] = system['TS']
             _stats_table[_bridge][system['SYSTEM']]['TGID'] = int_id(system['TGID'])
 
+            # Timers go out as absolute deadlines, the browser counts them down
             if system['TO_TYPE'] == 'ON' or system['TO_TYPE'] == 'OFF':
-                if system['TIMER'] - _now > 0:
-                    _stats_table[_bridge][system['SYSTEM']]['EXP_TIME'] = int(system['TIMER'] - _now)
-                else:
-                    _stats_table[_bridge][system['SYSTEM']]['EXP_TIME'] = 'Expired'
+                _stats_table[_bridge][system['SYSTEM']]['EXP_TIME'] = int(system['TIMER'])
                 if system['TO_TYPE'] == 'ON':
                     _stats_table[_bridge][system['SYSTEM']]['TO_ACTION'] = 'Disconnect'
                 else:
@@ -472,16 +518,177 @@ def build_bridge_table(_bridges):
                 _stats_table[_bridge][system['SYSTEM']]['COLOR'] = WHITE
                 _stats_table[_bridge][system['SYSTEM']]['BGCOLOR'] = RED
 
-            for i in range(len(system['ON'])):
-                system['ON'][i] = str(int_id(system['ON'][i]))
+            _stats_table[_bridge][system['SYSTEM']]['TRIG_ON'] = ', '.join(str(int_id(_tgid)) for _tgid in system['ON'])
+            _stats_table[_bridge][system['SYSTEM']]['TRIG_OFF'] = ', '.join(str(int_id(_tgid)) for _tgid in system['OFF'])
+    return _stats_table
+
+######################################################################
+#
+# TEMPLATE RENDERING, IN WORKER PROCESSES WHEN RENDER_WORKERS > 0
+#
 
-            _stats_table[_bridge][system['SYSTEM']]['TRIG_ON'] = ', '.join(system['ON'])
+def mk_env():
+    return Environment(
+        loader=PackageLoader('monitor', 'templates'),
+        autoescape=select_autoescape(['html', 'xml'])
+    )
 
-            for i in range(len(system['OFF'])):
-                system['OFF'][i] = str(int_id(system['OFF'][i]))
+def render_init():
+    # Runs once in every render worker process
+    global env
+    env = mk_env()
+
+def render_worker(_name, _state):
+    # Runs in a render worker, _state is a pickled snapshot taken on the reactor
+    return env.get_template(_name).render(**loads(_state))
+
+# Render a template once per version of the data behind it
+def render_cached(_name, _version, **_kwargs):
+    if _name not in RENDERED or RENDERED[_name][0] != _version:
+        RENDERED[_name] = (_version, env.get_template(_name).render(**_kwargs))
+    return RENDERED[_name][1]
+
+def render_table(_opcode, _name, _version, **_kwargs):
+    # Render _version of a table and broadcast it, on the reactor or in the worker pool
+    if RENDER_POOL is None:
+        dashboard_server.broadcast(_opcode + render_cached(_name, _version, **_kwargs))
+        SENT[_opcode] = _version
+        return
+    _pending = RENDERING.setdefault(_name, set())
+    if _version in _pending or len(_pending) >= RENDER_WORKERS:
+        return
+    _pending.add(_version)
+    _future = RENDER_POOL.submit(render_worker, _name, dumps(_kwargs, HIGHEST_PROTOCOL))
+    _future.add_done_callback(lambda _done: reactor.callFromThread(rendered, _opcode, _name, _version, _done))
+
+def rendered(_opcode, _name, _version, _future):
+    # Back on the reactor with a finished render
+    RENDERING[_name].discard(_version)
+    try:
+        _html = _future.result()
+    except Exception as err:
+        logging.error('Rendering %s version %s failed: %s', _name, _version, err)
+        return
+    if _name in RENDERED and RENDERED[_name][0] >= _version:
+        logging.debug('Dropping render of %s version %s, a newer one finished first', _name, _version)
+        return
+    RENDERED[_name] = (_version, _html)
+    dashboard_server.broadcast(_opcode + _html)
+    SENT[_opcode] = _version
+    # The state may have moved on while this one was rendering
+    build_stats()
 
-            _stats_table[_bridge][system['SYSTEM']]['TRIG_OFF'] = ', '.join(system['OFF'])
-    return _stats_table
+# The hblink table is assembled from fragments, one per master system, the peer systems, one
+# per OpenBridge and lastheard. Each is rendered again only once its own state has changed.
+def table_changed(*_fragments):
+    # New version of the hblink table: the named fragments changed, '*' for all of them, none for the page only
+    CTABLE['VERSION'] += 1
+    for _fragment in _fragments:
+        FRAGMENTS[_fragment] = CTABLE['VERSION']
+
+def fragment_version(_fragment):
+    return max(FRAGMENTS.get(_fragment, 0), FRAGMENTS['*'])
+
+def hblink_fragments():
+    # (key, template, arguments) of every fragment of the hblink table
+    _fragments = []
+    if CTABLE['SETUP']['LASTHEARD']:
+        _fragments.append(('LASTHEARD', 'lastheard.html', {}))
+    for _master, _mdata in CTABLE['MASTERS'].items():
+        _fragments.append((('MASTER', _master), 'hblink_master.html', {'_master': _master, '_mdata': _mdata, 'emaster': EMPTY_MASTERS}))
+    _fragments.append(('PEERS', 'hblink_peers.html', {'_peers': CTABLE['PEERS']}))
+    for _openbridge, _odata in CTABLE['OPENBRIDGES'].items():
+        _fragments.append((('OPENBRIDGE', _openbridge), 'hblink_openbridge.html', {'_openbridge': _openbridge, '_odata': _odata}))
+    return _fragments
+
+def render_fragments(_jobs):
+    # [(key, version, template, arguments)] to [(key, version, html)], on the reactor or in a render worker
+    _done = []
+    for _key, _version, _name, _kwargs in _jobs:
+        try:
+            _html = env.get_template(_name).render(**_kwargs)
+        except TemplateNotFound:
+            # lastheard.html is only written after the first call
+            _html = ''
+        _done.append((_key, _version, _html))
+    return _done
+
+def fragments_worker(_jobs):
+    return render_fragments(loads(_jobs))
+
+def store_fragments(_done):
+    for _key, _version, _html in _done:
+        if _key not in FRAGMENT_HTML or FRAGMENT_HTML[_key][0] < _version:
+            FRAGMENT_HTML[_key] = (_version, _html)
+
+def fragments_rendered(_keys, _future):
+    # Back on the reactor with fragments from a worker
+    RENDERING['hblink_table.html'].difference_update(_keys)
+    try:
+        store_fragments(_future.result())
+    except Exception as err:
+        logging.error('Rendering hblink table fragments failed: %s', err)
+        return
+    render_hblink()
+
+def update_hblink():
+    # Bring the assembled hblink table up to date, False while its fragments are rendering in the pool
+    _version = CTABLE['VERSION']
+    if 'hblink_table.html' in RENDERED and RENDERED['hblink_table.html'][0] == _version:
+        return True
+    _fragments = hblink_fragments()
+    _jobs = []
+    for _key, _name, _kwargs in _fragments:
+        _fversion = fragment_version(_key)
+        if _key not in FRAGMENT_HTML or FRAGMENT_HTML[_key][0] != _fversion:
+            _jobs.append((_key, _fversion, _name, _kwargs))
+    if _jobs and RENDER_POOL is None:
+        store_fragments(render_fragments(_jobs))
+    elif _jobs:
+        # One render of a fragment at a time, a newer version waits for it to finish
+        _pending = RENDERING.setdefault('hblink_table.html', set())
+        _jobs = [_job for _job in _jobs if _job[0] not in _pending]
+        if _jobs:
+            _keys = [_job[0] for _job in _jobs]
+            _pending.update(_keys)
+            _future = RENDER_POOL.submit(fragments_worker, dumps(_jobs, HIGHEST_PROTOCOL))
+            _future.add_done_callback(lambda _done: reactor.callFromThread(fragments_rendered, _keys, _done))
+        return False
+
+    # Only the frame is rendered here, the fragments go in as they are
+    _html = {_key: FRAGMENT_HTML[_key][1] for _key, _name, _kwargs in _fragments}
+    for _key in list(FRAGMENT_HTML):
+        if _key not in _html:
+            del FRAGMENT_HTML[_key]
+    RENDERED['hblink_table.html'] = (_version, env.get_template('hblink_table.html').render(
+        _table=CTABLE,
+        _lastheard=_html.get('LASTHEARD', ''),
+        _masters=[_html[('MASTER', _master)] for _master in CTABLE['MASTERS']],
+        _peers=_html['PEERS'],
+        _openbridges=[_html[('OPENBRIDGE', _openbridge)] for _openbridge in CTABLE['OPENBRIDGES']],
+        ))
+    return True
+
+def render_hblink():
+    if update_hblink():
+        dashboard_server.broadcast('d' + RENDERED['hblink_table.html'][1])
+        SENT['d'] = RENDERED['hblink_table.html'][0]
+
+def cached_hblink():
+    # For a new client, like cached_table()
+    update_hblink()
+    if 'hblink_table.html' in RENDERED:
+        return RENDERED['hblink_table.html'][1]
+
+def cached_table(_opcode, _name, _version, **_kwargs):
+    # For a new client. With workers this is the newest finished render, or None
+    # while the first one is running; either way a newer render gets broadcast.
+    if RENDER_POOL is None:
+        return render_cached(_name, _version, **_kwargs)
+    if _name not in RENDERED or RENDERED[_name][0] != _version:
+        render_table(_opcode, _name, _version, **_kwargs)
+    if _name in RENDERED:
+        return RENDERED[_name][1]
 
 ######################################################################
 #
@@ -494,12 +701,12 @@ def build_stats():
     global build_time
     now = time()
     if True: #now > build_time + 1:
-        if CONFIG:
-            table = 'd' + dtemplate.render(_table=CTABLE,emaster=EMPTY_MASTERS)
-            dashboard_server.broadcast(table)
-        if BRIDGES and BRIDGES_INC:
-            table = 'b' + btemplate.render(_table=BTABLE['BRIDGES'])
-            dashboard_server.broadcast(table)
+        # Nothing to send on an idle network, elapsed times are kept by the browser
+        if CONFIG_RX and SENT['d'] != CTABLE['VERSION']:
+            render_hblink()
+        # The bridge table only changes on BRIDGE_SND, skip it otherwise
+        if BRIDGES_RX and BRIDGES_INC and SENT['b'] != BTABLE['VERSION']:
+            render_table('b', 'bridge_table.html', BTABLE['VERSION'], _table=BTABLE['BRIDGES'])
         build_time = now
 
 
@@ -510,7 +717,8 @@ def timeout_clients():
             if dashboard_server.clients[client] + CLIENT_TIMEOUT < now:
                 logger.info('TIMEOUT: disconnecting client %s', dashboard_server.clients[client])
                 try:
-                    dashboard.sendClose(client)
+                    # Code 4000 tells the browser not to reconnect on its own
+                    client.sendClose(4000, 'Client timeout')
                 except Exception as e:
                     logger.error('Exception caught parsing client timeout %s', e)
     except:
@@ -589,6 +797,12 @@ def rts_update(p):
             CTABLE['PEERS'][system][timeSlot]['SRC'] = ''
             CTABLE['PEERS'][system][timeSlot]['DEST'] = ''
 
+    if system in CTABLE['MASTERS']:
+        table_changed(('MASTER', system))
+    elif system in CTABLE['OPENBRIDGES']:
+        table_changed(('OPENBRIDGE', system))
+    elif system in CTABLE['PEERS']:
+        table_changed('PEERS')
     build_stats()
 
 ######################################################################
@@ -607,25 +821,45 @@ def process_message(_bmessage):
         logging.debug('got CONFIG_SND opcode')
         CONFIG = load_dictionary(_bmessage)
         CONFIG_RX = strftime('%Y-%m-%d %H:%M:%S', localtime(time()))
+        if CTABLE['SETUP']['STALE']:
+            logging.info('First HBlink config received, dropping the stale flag of the restored snapshot')
+            CTABLE['SETUP']['STALE'] = False
+            CTABLE['VERSION'] += 1
         if CTABLE['MASTERS']:
             update_hblink_table(CONFIG, CTABLE)
         else:
             build_hblink_table(CONFIG, CTABLE)
+        if dashboard_server.feeding():
+            dashboard_server.publish('C' + ctable_json())
+        if HEALTH:
+            HEALTH.record(link_samples(CONFIG), time())
 
     elif opcode == OPCODE['BRIDGE_SND']:
         logging.debug('got BRIDGE_SND opcode')
         BRIDGES = load_dictionary(_bmessage)
         BRIDGES_RX = strftime('%Y-%m-%d %H:%M:%S', localtime(time()))
         if BRIDGES_INC:
-           BTABLE['BRIDGES'] = build_bridge_table(BRIDGES)
+           _bridges = build_bridge_table(BRIDGES)
+           # Timeouts are absolute, an unchanged table needs no new render or B frame
+           if _bridges != BTABLE['BRIDGES']:
+               BTABLE['BRIDGES'] = _bridges
+               BTABLE['VERSION'] += 1
+               if dashboard_server.feeding():
+                   dashboard_server.publish('B' + json.dumps(BTABLE['BRIDGES'], default=str))
 
     elif opcode == OPCODE['LINK_EVENT']:
-        logging.info('LINK_EVENT Received: {}'.format(repr(_message[1:])))
+        logging.info('LINK_EVENT Received: %r', _message[1:], extra={'category': 'LINK_EVENT'})
+        if dashboard_server.feeding():
+            dashboard_server.publish('E' + _message)
 
     elif opcode == OPCODE['BRDG_EVENT']:
-        logging.info('BRIDGE EVENT: {}'.format(repr(_message[1:])))
+        logging.info('BRIDGE EVENT: %r', _message[1:], extra={'category': 'BRDG_EVENT'})
+        if dashboard_server.feeding():
+            dashboard_server.publish('E' + _message)
         p = _message[1:].split(",")
         rts_update(p)
+        if p[0] == 'GROUP VOICE' and p[2] != 'TX':
+            HEARD[int(p[6])] = {'TIME': int(time()), 'SYSTEM': p[3], 'TS': int(p[7]), 'TGID': int(p[8])}
         opbfilter = get_opbf()
         if p[0] == 'GROUP VOICE' and p[2] != 'TX' and p[5] not in opbfilter:
             if p[1] == 'END':
@@ -663,6 +897,8 @@ def process_message(_bmessage):
                                break
                       f.write("</table></fieldset><br>")
                       f.close()
+                      # Included by hblink_table.html, picked up on the next tick
+                      table_changed('LASTHEARD')
                  # End of Lastheard
             elif p[1] == 'START':
                 log_message = '{} {} {} SYS: {:8.8s} SRC_ID: {:9.9s} TS: {} TGID: {:7.7s} {:17.17s} SUB: {:9.9s}; {:18.18s}'.format(_now[10:19], p[0][6:], p[1], p[3], p[5], p[7],p[8], alias_tgid(int(p[8]),talkgroup_ids), p[6], alias_short(int(p[6]), subscriber_ids))
@@ -685,11 +921,338 @@ def load_dictionary(_message):
     return loads(data)
     logging.debug('Successfully decoded dictionary')
 
+######################################################################
+#
+# WARM START SNAPSHOT OF THE DASHBOARD STATE
+#
+
+def save_snapshot():
+    # Pickled on the reactor so the state is consistent, written to disk in a thread
+    _versions = (CTABLE['VERSION'], BTABLE['VERSION'])
+    if _versions == SAVED:
+        return
+    # Tables cleared when HBlink was lost, or not refreshed since the restore, would only replace a good snapshot
+    if CTABLE['SETUP']['STALE'] or not (CTABLE['MASTERS'] or CTABLE['PEERS'] or CTABLE['OPENBRIDGES']):
+        return
+    _data = dumps({
+        'TIME': time(),
+        'MASTERS': CTABLE['MASTERS'],
+        'PEERS': CTABLE['PEERS'],
+        'OPENBRIDGES': CTABLE['OPENBRIDGES'],
+        'BRIDGES': BTABLE['BRIDGES'],
+        'LOGBUF': list(LOGBUF),
+        'HEARD': HEARD,
+        }, HIGHEST_PROTOCOL)
+    return threads.deferToThread(write_snapshot, _data).addCallback(snapshot_saved, _versions)
+
+def snapshot_saved(_written, _versions):
+    # A failed write is tried again on the next tick
+    global SAVED
+    if _written:
+        SAVED = _versions
+
+def write_snapshot(_data):
+    # Write to a temporary file and rename it, a crash never leaves a half written snapshot
+    _tmp = PATH + SNAPSHOT_FILE + '.tmp'
+    try:
+        with open(_tmp, 'wb') as _file:
+            _file.write(_data)
+            _file.flush()
+            os.fsync(_file.fileno())
+        os.replace(_tmp, PATH + SNAPSHOT_FILE)
+    except OSError as err:
+        logging.error('Could not save snapshot %s: %s', PATH + SNAPSHOT_FILE, err)
+        return False
+    return True
+
+def load_snapshot():
+    try:
+        with open(PATH + SNAPSHOT_FILE, 'rb') as _file:
+            _snapshot = loads(_file.read())
+    except FileNotFoundError:
+        return
+    except (OSError, EOFError, UnpicklingError) as err:
+        logging.error('Could not load snapshot %s: %s', PATH + SNAPSHOT_FILE, err)
+        return
+
+    CTABLE['MASTERS'] = _snapshot['MASTERS']
+    CTABLE['PEERS'] = _snapshot['PEERS']
+    CTABLE['OPENBRIDGES'] = _snapshot['OPENBRIDGES']
+    CTABLE['SETUP']['STALE'] = strftime('%Y-%m-%d %H:%M:%S', localtime(_snapshot['TIME']))
+    table_changed('*')
+    if BRIDGES_INC:
+        BTABLE['BRIDGES'] = _snapshot['BRIDGES']
+        BTABLE['VERSION'] += 1
+    LOGBUF.extend(_snapshot['LOGBUF'])
+    HEARD.update(_snapshot.get('HEARD', {}))
+    logging.info('Restored dashboard state saved at %s, marked stale until HBlink reports', CTABLE['SETUP']['STALE'])
+
+######################################################################
+#
+# ALIAS FILES AND SUBSCRIBER SEARCH
+#
+
+def load_aliases():
+    # Runs at startup and then in a thread: download stale files, build the dictionaries and the search index
+    result = try_download(PATH, PEER_FILE, PEER_URL, (FILE_RELOAD * 86400))
+    logging.info(result)
+
+    result = try_download(PATH, SUBSCRIBER_FILE, SUBSCRIBER_URL, (FILE_RELOAD * 86400))
+    logging.info(result)
+
+    # Make Alias Dictionaries
+    _peer_ids = mk_full_id_dict(PATH, PEER_FILE, 'peer')
+    if _peer_ids:
+        logging.info('ID ALIAS MAPPER: peer_ids dictionary is available')
+
+    _subscriber_ids = mk_full_id_dict(PATH, SUBSCRIBER_FILE, 'subscriber')
+    if _subscriber_ids:
+        logging.info('ID ALIAS MAPPER: subscriber_ids dictionary is available')
+
+    _talkgroup_ids = mk_full_id_dict(PATH, TGID_FILE, 'tgid')
+    if _talkgroup_ids:
+        logging.info('ID ALIAS MAPPER: talkgroup_ids dictionary is available')
+
+    _local_subscriber_ids = mk_full_id_dict(PATH, LOCAL_SUB_FILE, 'subscriber')
+    if _local_subscriber_ids:
+        logging.info('ID ALIAS MAPPER: local_subscriber_ids added to subscriber_ids dictionary')
+        _subscriber_ids.update(_local_subscriber_ids)
+
+    _local_peer_ids = mk_full_id_dict(PATH, LOCAL_PEER_FILE, 'peer')
+    if _local_peer_ids:
+        logging.info('ID ALIAS MAPPER: local_peer_ids added peer_ids dictionary')
+        _peer_ids.update(_local_peer_ids)
+
+    _index = mk_search_index(_subscriber_ids)
+    logging.info('SUBSCRIBER SEARCH: %s keys indexed', len(_index[0]))
+    return _peer_ids, _subscriber_ids, _talkgroup_ids, _index
+
+def set_aliases(_aliases):
+    global peer_ids, subscriber_ids, talkgroup_ids, SEARCH_INDEX
+    peer_ids, subscriber_ids, talkgroup_ids, SEARCH_INDEX = _aliases
+
+def alias_error(_failure):
+    # A bad download keeps the dictionaries we have, and the daily refresh running
+    logging.error('ID ALIAS MAPPER: refresh failed, keeping the current dictionaries: %s', _failure.getErrorMessage())
+
+def refresh_aliases():
+    return threads.deferToThread(load_aliases).addCallbacks(set_aliases, alias_error)
+
+def mk_search_index(_subscribers):
+    # Sorted keys with the matching ids: the callsign and every word of the name
+    _entries = []
+    for _id, _sub in _subscribers.items():
+        if _sub['CALLSIGN']:
+            _entries.append((str(_sub['CALLSIGN']).upper(), _id))
+        for _word in set(str(_sub['NAME']).upper().split()):
+            _entries.append((_word, _id))
+    _entries.sort()
+    return [_key for _key, _id in _entries], [_id for _key, _id in _entries]
+
+def search_subscribers(_query):
+    # The longest word is looked up by prefix in the index, the others must prefix a word of the same record
+    _words = _query.upper().split()
+    if not _words:
+        return []
+    _keys, _ids = SEARCH_INDEX
+    _found = []
+    if _words[0].isdecimal() and int(_words[0]) in subscriber_ids:
+        _found.append(int(_words[0]))
+    _lookup = max(_words, key=len)
+    _pos = bisect_left(_keys, _lookup)
+    while _pos < len(_keys) and _keys[_pos].startswith(_lookup) and len(_found) < SEARCH_LIMIT:
+        _id = _ids[_pos]
+        _pos += 1
+        if _id in _found:
+            continue
+        if len(_words) > 1:
+            _record = (str(subscriber_ids[_id]['CALLSIGN']) + ' ' + str(subscriber_ids[_id]['NAME'])).upper().split()
+            if not all(any(_key.startswith(_word) for _key in _record) for _word in _words):
+                continue
+        _found.append(_id)
+
+    _results = []
+    for _id in _found:
+        _sub = subscriber_ids[_id]
+        _results.append({
+            'ID': _id,
+            'CALLSIGN': _sub['CALLSIGN'],
+            'NAME': _sub['NAME'],
+            'CITY': _sub['CITY'],
+            'COUNTRY': _sub['COUNTRY'],
+            'LASTHEARD': HEARD.get(_id),
+            })
+    return _results
+
+######################################################################
+#
+# PEER LINK HEALTH HISTORY
+#
+
+def link_samples(_config):
+    # (key, up, connected since, pings answered, pings sent) for every peer in a CONFIG_SND.
+    # Repeaters on our masters ping us, so only peer systems know about lost pings.
+    for _hbp, _hbp_data in _config.items():
+        if _hbp_data['ENABLED'] != True:
+            continue
+        if _hbp_data['MODE'] == 'MASTER':
+            for _peer, _peer_data in _hbp_data['PEERS'].items():
+                _pings = _peer_data.get('PINGS_RECEIVED', 0)
+                yield '{}/{}'.format(_hbp, int_id(_peer)), _peer_data['CONNECTION'] == 'YES', int(_peer_data['CONNECTED']), _pings, _pings
+        elif _hbp_data['MODE'] in ('PEER', 'XLXPEER'):
+            _stats = _hbp_data['XLXSTATS'] if _hbp_data['MODE'] == 'XLXPEER' else _hbp_data['STATS']
+            if _stats['CONNECTION'] == 'YES':
+                yield _hbp, True, int(_stats['CONNECTED']), _stats['PINGS_ACKD'], _stats['PINGS_SENT']
+            else:
+                yield _hbp, False, 0, 0, 0
+
+class linkTier(object):
+    # A ring of time slots, each slot holding one array per field indexed by peer row.
+    # Slots of the raw tier are single samples, rollup slots cover span seconds.
+    def __init__(self, slots, span):
+        self.slots = slots
+        self.span = span
+        self.stamp = array('d', [0.0]) * slots
+        self.count = array('H', [0]) * slots
+        self.data = {_field: [array('H')] * slots for _field in linkHistory.FIELDS}
+        self.pos = 0
+        # Sums for the slot being filled
+        self.bucket = None
+        self.acc = {_field: [] for _field in linkHistory.FIELDS}
+        self.acc_count = 0
+
+    def store(self, _stamp, _count, _columns):
+        self.pos = (self.pos + 1) % self.slots
+        self.stamp[self.pos] = _stamp
+        self.count[self.pos] = min(_count, 0xFFFF)
+        for _field, _column in _columns.items():
+            self.data[_field][self.pos] = array('H', map(min, _column, repeat(0xFFFF)))
+
+    def add(self, _now, _columns, _rows):
+        _bucket = int(_now // self.span)
+        if _bucket != self.bucket:
+            if self.bucket is not None:
+                self.store(self.bucket * self.span, self.acc_count, self.acc)
+            self.bucket = _bucket
+            self.acc = {_field: [0] * _rows for _field in linkHistory.FIELDS}
+            self.acc_count = 0
+        for _field, _column in _columns.items():
+            _acc = self.acc[_field]
+            _acc.extend([0] * (_rows - len(_acc)))
+            self.acc[_field] = list(map(add, _acc, _column))
+        self.acc_count += 1
+
+    def series(self, _row):
+        _series = {'STEP': self.span, 'TIME': []}
+        _series.update({_field: [] for _field in linkHistory.FIELDS})
+        for _slot in range(self.pos + 1, self.pos + 1 + self.slots):
+            _slot %= self.slots
+            if not self.count[_slot]:
+                continue
+            _series['TIME'].append(int(self.stamp[_slot]))
+            for _field in linkHistory.FIELDS:
+                _column = self.data[_field][_slot]
+                _value = _column[_row] if _row < len(_column) else 0
+                if _field == 'UP':
+                    _value = round(_value / self.count[_slot], 3)
+                _series[_field].append(_value)
+        # The slot still being filled, so sparklines reach up to now
+        if self.bucket is not None and self.acc_count:
+            _series['TIME'].append(self.bucket * self.span)
+            for _field in linkHistory.FIELDS:
+                _acc = self.acc[_field]
+                _value = _acc[_row] if _row < len(_acc) else 0
+                if _field == 'UP':
+                    _value = round(_value / self.acc_count, 3)
+                _series[_field].append(_value)
+        return _series
+
+class linkHistory(object):
+    # Link health of every peer as fixed size arrays: the latest raw CONFIG_SND samples,
+    # then minute and hour rollups. Peers are rows, freed once all their history has expired.
+    FIELDS = ('UP', 'PINGS', 'LOST', 'CONNECTS')
+
+    def __init__(self, raw, minutes, hours):
+        self.tiers = {
+            'raw': linkTier(raw, 0),
+            'minute': linkTier(minutes, 60),
+            'hour': linkTier(hours, 3600),
+            }
+        self.rows = {}
+        self.free = []
+        self.seen = array('d')
+        self.last_pings = array('L')
+        self.last_sent = array('L')
+        self.last = 0
+
+    def row(self, _key, _pings, _sent):
+        if _key in self.rows:
+            return self.rows[_key]
+        if self.free:
+            _row = self.free.pop()
+            self.last_pings[_row] = _pings
+            self.last_sent[_row] = _sent
+        else:
+            _row = len(self.seen)
+            self.seen.append(0)
+            self.last_pings.append(_pings)
+            self.last_sent.append(_sent)
+        self.rows[_key] = _row
+        return _row
+
+    def expire(self, _now):
+        _limit = _now - self.tiers['hour'].slots * 3600
+        for _key, _row in list(self.rows.items()):
+            if self.seen[_row] < _limit:
+                del self.rows[_key]
+                self.free.append(_row)
+
+    def record(self, _samples, _now):
+        _samples = [(self.row(_key, _pings, _sent), _up, _connected, _pings, _sent) for _key, _up, _connected, _pings, _sent in _samples]
+        _rows = len(self.seen)
+        _columns = {_field: [0] * _rows for _field in self.FIELDS}
+        for _row, _up, _connected, _pings, _sent in _samples:
+            # Counters start over when the link comes back
+            _dpings = _pings - self.last_pings[_row] if _pings >= self.last_pings[_row] else _pings
+            _dsent = _sent - self.last_sent[_row] if _sent >= self.last_sent[_row] else _sent
+            self.last_pings[_row] = _pings
+            self.last_sent[_row] = _sent
+            self.seen[_row] = _now
+            _columns['UP'][_row] = int(_up)
+            _columns['PINGS'][_row] = _dpings
+            _columns['LOST'][_row] = max(_dsent - _dpings, 0)
+            _columns['CONNECTS'][_row] = int(_up and self.last and _connected > self.last)
+
+        self.tiers['raw'].store(_now, 1, _columns)
+        _hour = self.tiers['hour'].bucket
+        self.tiers['minute'].add(_now, _columns, _rows)
+        self.tiers['hour'].add(_now, _columns, _rows)
+        if _hour is not None and _hour != self.tiers['hour'].bucket:
+            self.expire(_now)
+        self.last = _now
+
+    def peers(self):
+        return sorted(self.rows)
+
+    def history(self, _key, _tier):
+        if _key not in self.rows or _tier not in self.tiers:
+            return None
+        return self.tiers[_tier].series(self.rows[_key])
+
 ######################################################################
 #
 # COMMUNICATION WITH THE HBlink INSTANCE
 #
 
+def clear_tables():
+    CTABLE['MASTERS'].clear()
+    CTABLE['PEERS'].clear()
+    CTABLE['OPENBRIDGES'].clear()
+    table_changed('*')
+    BTABLE['BRIDGES'].clear()
+    BTABLE['VERSION'] += 1
+
+
 class report(NetstringReceiver):
     def __init__(self):
         pass
@@ -710,7 +1273,8 @@ class reportClientFactory(ReconnectingClientFactory):
 
     def startedConnecting(self, connector):
         logging.info('Initiating Connection to Server.')
-        if 'dashboard_server' in locals() or 'dashboard_server' in globals():
+        # A q frame blanks the browser tables, the restored ones stay up until HBlink reports
+        if ('dashboard_server' in locals() or 'dashboard_server' in globals()) and not CTABLE['SETUP']['STALE']:
             dashboard_server.broadcast('q' + 'Connection to HBlink Established')
 
     def buildProtocol(self, addr):
@@ -720,18 +1284,161 @@ class reportClientFactory(ReconnectingClientFactory):
         return report()
 
     def clientConnectionLost(self, connector, reason):
-        CTABLE['MASTERS'].clear()
-        CTABLE['PEERS'].clear()
-        CTABLE['OPENBRIDGES'].clear()
-        BTABLE['BRIDGES'].clear()
+        clear_tables()
         logging.info('Lost connection.  Reason: %s', reason)
         ReconnectingClientFactory.clientConnectionLost(self, connector, reason)
         dashboard_server.broadcast('q' + 'Connection to HBlink Lost')
+        if dashboard_server.feeding():
+            dashboard_server.publish('Q' + 'Connection to HBlink Lost')
 
     def clientConnectionFailed(self, connector, reason):
         logging.info('Connection failed. Reason: %s', reason)
         ReconnectingClientFactory.clientConnectionFailed(self, connector, reason)
 
+######################################################################
+#
+# RELAY MODE: MIRROR ANOTHER MONITOR'S STATE FEED INSTEAD OF HBlink
+#
+#   The state feed (?feed=state&token=<RELAY_TOKEN> on the websocket port) carries, besides the
+#   'h' hello, JSON snapshots 'S', hblink tables 'C' after every CONFIG_SND,
+#   bridge tables 'B', raw HBlink events 'E' and 'Q' when HBlink was lost.
+#
+
+# Repeater, master and OpenBridge addresses are never rendered, so they stay off the feed
+PRIVATE_FIELDS = ('IP', 'PORT', 'MASTER_IP', 'MASTER_PORT', 'TARGET_IP', 'TARGET_PORT')
+
+def public(_data):
+    return {_key: _value for _key, _value in _data.items() if _key not in PRIVATE_FIELDS}
+
+def feed_tables():
+    return {
+        'MASTERS': {_hbp: dict(_master, PEERS={_peer: public(_pdata) for _peer, _pdata in _master['PEERS'].items()}) for _hbp, _master in CTABLE['MASTERS'].items()},
+        'PEERS': {_hbp: public(_data) for _hbp, _data in CTABLE['PEERS'].items()},
+        'OPENBRIDGES': {_hbp: public(_data) for _hbp, _data in CTABLE['OPENBRIDGES'].items()},
+        }
+
+def ctable_json():
+    return json.dumps(feed_tables(), default=str)
+
+def slots_from_json(_data):
+    # JSON turned the timeslot keys into strings
+    for _ts in ('1', '2'):
+        if _ts in _data:
+            _data[int(_ts)] = _data.pop(_ts)
+    return _data
+
+def ctable_from_json(_tables):
+    for _master in _tables['MASTERS'].values():
+        _master['PEERS'] = {int(_peer): slots_from_json(_pdata) for _peer, _pdata in _master['PEERS'].items()}
+    for _pdata in _tables['PEERS'].values():
+        slots_from_json(_pdata)
+    # Only the systems that differ from what we have get rendered again
+    _changed = {('MASTER', _master) for _master, _mdata in _tables['MASTERS'].items() if CTABLE['MASTERS'].get(_master) != _mdata}
+    _changed.update(('OPENBRIDGE', _openbridge) for _openbridge, _odata in _tables['OPENBRIDGES'].items() if CTABLE['OPENBRIDGES'].get(_openbridge) != _odata)
+    if CTABLE['PEERS'] != _tables['PEERS']:
+        _changed.add('PEERS')
+    _layout = list(CTABLE['MASTERS']) != list(_tables['MASTERS']) or list(CTABLE['OPENBRIDGES']) != list(_tables['OPENBRIDGES'])
+    CTABLE['MASTERS'] = _tables['MASTERS']
+    CTABLE['PEERS'] = _tables['PEERS']
+    CTABLE['OPENBRIDGES'] = _tables['OPENBRIDGES']
+    if _changed or _layout or CTABLE['SETUP']['STALE']:
+        CTABLE['SETUP']['STALE'] = False
+        table_changed(*_changed)
+
+def process_relay(_opcode, _data):
+    global CONFIG_RX, BRIDGES_RX
+    _now = strftime('%Y-%m-%d %H:%M:%S', localtime(time()))
+
+    if _opcode == 'S':
+        _snapshot = json.loads(_data)
+        ctable_from_json(_snapshot['CTABLE'])
+        CONFIG_RX = _now
+        if BRIDGES_INC:
+            BTABLE['BRIDGES'] = _snapshot['BRIDGES']
+            BTABLE['VERSION'] += 1
+            BRIDGES_RX = _now
+        # A snapshot replaces the log, it is sent again after every reconnect
+        LOGBUF.clear()
+        LOGBUF.extend(_snapshot['LOGBUF'])
+        HEARD.update({int(_id): _heard for _id, _heard in _snapshot['HEARD'].items()})
+        build_stats()
+        if dashboard_server.feeding():
+            dashboard_server.publish('C' + ctable_json())
+            dashboard_server.publish('B' + json.dumps(BTABLE['BRIDGES'], default=str))
+
+    elif _opcode == 'C':
+        ctable_from_json(json.loads(_data))
+        CONFIG_RX = _now
+        build_stats()
+        if dashboard_server.feeding():
+            dashboard_server.publish('C' + _data)
+
+    elif _opcode == 'B':
+        if BRIDGES_INC:
+            BTABLE['BRIDGES'] = json.loads(_data)
+            BTABLE['VERSION'] += 1
+            BRIDGES_RX = _now
+            build_stats()
+        if dashboard_server.feeding():
+            dashboard_server.publish('B' + _data)
+
+    elif _opcode == 'E':
+        # Applied exactly as HBlink's own event, which also passes it on to our feeds
+        process_message(_data.encode('utf-8'))
+
+    elif _opcode == 'Q':
+        clear_tables()
+        dashboard_server.broadcast('q' + _data)
+        if dashboard_server.feeding():
+            dashboard_server.publish('Q' + _data)
+
+class relay(WebSocketClientProtocol):
+
+    def onOpen(self):
+        logging.info('Connected to upstream monitor %s', RELAY_URL)
+        self.factory.resetDelay()
+
+    def onMessage(self, payload, isBinary):
+        _frame = payload.decode('utf-8')
+        _sep = _frame.find(',')
+        _opcode = _frame[:1]
+        self.factory.seq = int(_frame[1:_sep])
+        if _opcode == 'h':
+            self.factory.epoch = _frame[_sep+1:].split(',')[0]
+        else:
+            process_relay(_opcode, _frame[_sep+1:])
+
+class relayClientFactory(WebSocketClientFactory, ReconnectingClientFactory):
+    protocol = relay
+
+    def __init__(self, url):
+        self.url_feed = '{}/?feed=state&token={}'.format(url, quote(RELAY_TOKEN, safe=''))
+        WebSocketClientFactory.__init__(self, self.url_feed)
+        self.epoch = None
+        self.seq = 0
+
+    def resume(self):
+        # Reconnect asking for only what was missed
+        if self.epoch:
+            self.setSessionParameters(url='{}&epoch={}&seq={}'.format(self.url_feed, self.epoch, self.seq))
+
+    def clientConnectionLost(self, connector, reason):
+        logging.info('Lost connection to upstream monitor.  Reason: %s', reason)
+        # Keep the tables for a resume, but show them as stale until the next C or S frame
+        if not CTABLE['SETUP']['STALE']:
+            CTABLE['SETUP']['STALE'] = CONFIG_RX or strftime('%Y-%m-%d %H:%M:%S', localtime(time()))
+            table_changed()
+        dashboard_server.broadcast('q' + 'Connection to upstream monitor Lost')
+        if dashboard_server.feeding():
+            dashboard_server.publish('Q' + 'Connection to upstream monitor Lost')
+        self.resume()
+        ReconnectingClientFactory.clientConnectionLost(self, connector, reason)
+
+    def clientConnectionFailed(self, connector, reason):
+        logging.info('Connection to upstream monitor failed. Reason: %s', reason)
+        self.resume()
+        ReconnectingClientFactory.clientConnectionFailed(self, connector, reason)
+
 ######################################################################
 #
 # WEBSOCKET COMMUNICATION WITH THE DASHBOARD CLIENT
@@ -741,20 +1448,62 @@ class dashboard(WebSocketServerProtocol):
 
     def onConnect(self, request):
         logging.info('Client connecting: %s', request.peer)
+        # A reconnecting browser asks to resume with ?epoch=<epoch>&seq=<last seq seen>,
+        # relays ask for the state feed with ?feed=state&token=<RELAY_TOKEN>
+        self.feed = request.params.get('feed', [''])[0] == 'state'
+        if self.feed and not (RELAY_TOKEN and compare_digest(request.params.get('token', [''])[0].encode('utf-8'), RELAY_TOKEN.encode('utf-8'))):
+            logging.warning('Refused the state feed to %s, RELAY_TOKEN missing or wrong', request.peer)
+            raise ConnectionDeny(ConnectionDeny.FORBIDDEN)
+        self.resume = None
+        try:
+            self.resume = (request.params['epoch'][0], int(request.params['seq'][0]))
+        except (KeyError, IndexError, ValueError):
+            pass
 
     def onOpen(self):
         logging.info('WebSocket connection open.')
         self.factory.register(self)
-        self.sendMessage(('d' + dtemplate.render(_table=CTABLE,emaster=EMPTY_MASTERS)).encode('utf-8'))
-        self.sendMessage(('b' + btemplate.render(_table=BTABLE['BRIDGES'])).encode('utf-8'))
-        for _message in LOGBUF:
-            if _message:
-                _bmessage = ('l' + _message).encode('utf-8')
-                self.sendMessage(_bmessage)
-                
+        missed = None
+        if self.resume:
+            missed = self.factory.missed(self.resume[0], self.resume[1], self.feed)
+        if missed is not None:
+            logging.info('Client %s resumed from %s, replaying %s frames', self.peer, self.resume[1], len(missed))
+            for _frame in missed:
+                self.sendMessage(_frame)
+        elif self.feed:
+            self.send_feed_snapshot()
+        else:
+            self.send_snapshot()
+
+    def send_snapshot(self):
+        # Full state, stamped with the current sequence number: hello, both tables and the log backlog in one frame
+        self.sendMessage(self.factory.frame('h{},{}'.format(self.factory.epoch, time())))
+        _table = cached_hblink()
+        if _table is not None:
+            self.sendMessage(self.factory.frame('d' + _table))
+        _table = cached_table('b', 'bridge_table.html', BTABLE['VERSION'], _table=BTABLE['BRIDGES'])
+        if _table is not None:
+            self.sendMessage(self.factory.frame('b' + _table))
+        _backlog = '\n'.join(_message for _message in LOGBUF if _message)
+        if _backlog:
+            self.sendMessage(self.factory.frame('l' + _backlog))
+
+    def send_feed_snapshot(self):
+        self.sendMessage(self.factory.frame('h{},{}'.format(self.factory.epoch, time())))
+        self.sendMessage(self.factory.frame('S' + json.dumps({
+            'CTABLE': feed_tables(),
+            'BRIDGES': BTABLE['BRIDGES'],
+            'LOGBUF': [_message for _message in LOGBUF if _message],
+            'HEARD': HEARD,
+            }, default=str)))
+
     def onMessage(self, payload, isBinary):
         if isBinary:
             logging.info('Binary message received: %s bytes', len(payload))
+        elif payload[:1] == b's':
+            # Subscriber search, answered to this client only
+            _results = search_subscribers(payload[1:].decode('utf-8', 'ignore'))
+            self.sendMessage(self.factory.frame('s' + json.dumps(_results)))
         else:
             logging.info('Text message received: %s', payload)
 
@@ -770,23 +1519,81 @@ class dashboardFactory(WebSocketServerFactory):
     def __init__(self, url):
         WebSocketServerFactory.__init__(self, url)
         self.clients = {}
+        self.feeds = {}
+        # Every outbound frame is '<opcode><seq>,<payload>'. The epoch changes on
+        # every restart so clients never resume against a different sequence.
+        self.epoch = '{:x}'.format(int(time()))
+        self.seq = 0
+        # Recent log and event frames, kept apart for browsers (False) and relays (True) so neither
+        # pushes the other's out, with the last sequence number each has dropped
+        self.replay = {False: deque(maxlen=REPLAY_SIZE), True: deque(maxlen=REPLAY_SIZE)}
+        self.dropped = {False: 0, True: 0}
+        # Table frames are whole tables, only the newest of each kind is kept: {opcode: (seq, frame)}
+        self.tables = {}
+        # Feed frames are only built while a relay is connected, older ones can't be replayed
+        self.feed_gap = 0
 
     def register(self, client):
-        if client not in self.clients:
-            logging.info('registered client %s', client.peer)
-            self.clients[client] = time()
+        _clients = self.feeds if client.feed else self.clients
+        if client not in _clients:
+            logging.info('registered %s %s', 'relay' if client.feed else 'client', client.peer)
+            _clients[client] = time()
 
     def unregister(self, client):
-        if client in self.clients:
-            logging.info('unregistered client %s', client.peer)
-            del self.clients[client]
+        for _clients in (self.clients, self.feeds):
+            if client in _clients:
+                logging.info('unregistered client %s', client.peer)
+                del _clients[client]
+
+    def frame(self, msg):
+        # Stamp a message for a single client with the current sequence number
+        return '{}{},{}'.format(msg[:1], self.seq, msg[1:]).encode('utf8')
+
+    def missed(self, epoch, seq, feed=False):
+        # Frames a client that last saw seq has missed, or None if the gap is too old to replay
+        if epoch != self.epoch or seq > self.seq or (feed and seq < self.feed_gap):
+            return None
+        if seq == self.seq:
+            return []
+        if seq < self.dropped[feed]:
+            return None
+        _tables = ('C', 'B') if feed else ('d', 'b')
+        _frames = [(_seq, _frame) for _seq, _frame in self.replay[feed] if _seq > seq]
+        _frames.extend(self.tables[_opcode] for _opcode in _tables if _opcode in self.tables and self.tables[_opcode][0] > seq)
+        return [_frame for _seq, _frame in sorted(_frames)]
+
+    def keep(self, msg, _frame, feed):
+        if msg[:1] in ('d', 'b', 'C', 'B'):
+            self.tables[msg[:1]] = (self.seq, _frame)
+            return
+        _replay = self.replay[feed]
+        if len(_replay) == _replay.maxlen:
+            self.dropped[feed] = _replay[0][0] if _replay else self.seq
+        _replay.append((self.seq, _frame))
 
     def broadcast(self, msg):
         logging.debug('broadcasting message to: %s', self.clients)
+        self.seq += 1
+        _frame = self.frame(msg)
+        self.keep(msg, _frame, False)
         for c in self.clients:
-            c.sendMessage(msg.encode('utf8'))
+            c.sendMessage(_frame)
             logging.debug('message sent to %s', c.peer)
 
+    def feeding(self):
+        # Whether anyone takes the state feed, if not it isn't built at all
+        if self.feeds:
+            return True
+        self.feed_gap = self.seq + 1
+        return False
+
+    def publish(self, msg):
+        self.seq += 1
+        _frame = self.frame(msg)
+        self.keep(msg, _frame, True)
+        for c in self.feeds:
+            c.sendMessage(_frame)
+
 ######################################################################
 #
 # STATIC WEBSERVER
@@ -795,7 +1602,7 @@ class dashboardFactory(WebSocketServerFactory):
 class web_server(Resource):
     isLeaf = True
     def render_GET(self, request):
-        logging.info('static website requested: %s', request)
+        logging.info('static website requested: %s', request.uri, extra={'category': 'HTTP'})
         if WEB_AUTH:
           user = WEB_USER.encode('utf-8')
           password = WEB_PASS.encode('utf-8')
@@ -804,7 +1611,7 @@ class web_server(Resource):
              decodeddata = base64.b64decode(auth.split(' ')[1])
              if decodeddata.split(b':') == [user, password]:
                  logging.info('Authorization OK')
-                 return (index_html).encode('utf-8')
+                 return self.page(request)
           request.setResponseCode(401)
           request.setHeader('WWW-Authenticate', 'Basic realm="realmname"')
           logging.info('Someone wanted to get access without authorization')
@@ -814,21 +1621,100 @@ class web_server(Resource):
                      border-bottom-left-radius: 10px; border-bottom-right-radius: 10px;\"> \
                   <p><font size=5><b>Authorization Required</font></p></filed></center></body></html>".encode('utf-8')
         else:
-            return (index_html).encode('utf-8')
-        
+            return self.page(request)
+
+    def page(self, request):
+        if request.path == b'/search':
+            request.setHeader('Content-Type', 'application/json; charset=utf-8')
+            _query = request.args.get(b'q', [b''])[0].decode('utf-8', 'ignore')
+            return json.dumps(search_subscribers(_query)).encode('utf-8')
+        if request.path == b'/health':
+            # /health lists the peers, /health?peer=<system or system/peer id>&tier=raw|minute|hour their history
+            request.setHeader('Content-Type', 'application/json; charset=utf-8')
+            if not HEALTH:
+                return json.dumps(None).encode('utf-8')
+            _peer = request.args.get(b'peer', [b''])[0].decode('utf-8', 'ignore')
+            if not _peer:
+                return json.dumps(HEALTH.peers()).encode('utf-8')
+            _tier = request.args.get(b'tier', [b'minute'])[0].decode('utf-8', 'ignore')
+            _history = HEALTH.history(_peer, _tier)
+            if _history is None:
+                request.setResponseCode(404)
+            return json.dumps(_history).encode('utf-8')
+        return (index_html).encode('utf-8')
+
+######################################################################
+#
+# LOGGING KEPT OFF THE REACTOR
+#
+
+class logRateLimiter(logging.Filter):
+    # Sampling and a token bucket per category for the high-volume lines, tagged with extra={'category': ...}
+    def __init__(self, rate, sample):
+        logging.Filter.__init__(self)
+        self.rate = rate
+        self.sample = sample
+        self.categories = {}
+
+    def filter(self, record):
+        category = getattr(record, 'category', None)
+        if category is None:
+            return True
+        now = time()
+        if category not in self.categories:
+            self.categories[category] = {'SEEN': 0, 'TOKENS': self.rate, 'STAMP': now, 'SUPPRESSED': 0}
+        state = self.categories[category]
+        state['SEEN'] += 1
+        if self.sample > 1 and state['SEEN'] % self.sample:
+            return False
+        if self.rate > 0:
+            state['TOKENS'] = min(self.rate, state['TOKENS'] + (now - state['STAMP']) * self.rate)
+            state['STAMP'] = now
+            if state['TOKENS'] < 1:
+                state['SUPPRESSED'] += 1
+                return False
+            state['TOKENS'] -= 1
+            if state['SUPPRESSED']:
+                record.msg = record.msg + ' (%s %s lines suppressed)'
+                record.args = tuple(record.args or ()) + (state['SUPPRESSED'], category)
+                state['SUPPRESSED'] = 0
+        return True
+
+class logQueueHandler(QueueHandler):
+    # Never block the reactor on a full queue, drop the record and say so once there is room
+    def __init__(self, queue):
+        QueueHandler.__init__(self, queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+            return
+        if self.dropped:
+            try:
+                self.queue.put_nowait(logging.makeLogRecord({'msg': 'Log queue full, %s records dropped', 'args': (self.dropped,), 'levelno': logging.WARNING, 'levelname': 'WARNING'}))
+                self.dropped = 0
+            except Full:
+                pass
+
 if __name__ == '__main__':
-    logging.basicConfig(
-        level=logging.INFO,
-        filename = (LOG_PATH + LOG_NAME),
-        filemode='a',
-        format='%(asctime)s %(levelname)s %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
+    # The file and console handlers run in a listener thread, the reactor only queues records
+    logfile = logging.FileHandler(LOG_PATH + LOG_NAME, 'a')
+    logfile.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s', '%Y-%m-%d %H:%M:%S'))
     console = logging.StreamHandler()
     console.setLevel(logging.INFO)
     formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
     console.setFormatter(formatter)
-    logging.getLogger('').addHandler(console)
+    log_queue = Queue(LOG_QUEUE_SIZE)
+    queue_handler = logQueueHandler(log_queue)
+    queue_handler.addFilter(logRateLimiter(LOG_RATE_LIMIT, LOG_SAMPLE))
+    logging.getLogger('').setLevel(logging.INFO)
+    logging.getLogger('').addHandler(queue_handler)
+    log_listener = QueueListener(log_queue, logfile, console, respect_handler_level=True)
+    log_listener.start()
+    reactor.addSystemEventTrigger('after', 'shutdown', log_listener.stop)
     logger = logging.getLogger(__name__)
 
     logging.info('monitor.py starting up')
@@ -840,53 +1726,40 @@ if __name__ == '__main__':
          logging.info('Check lastheard.log file')
       except CalledProcessError as err:
          print(err)
-    # Download alias files
-    result = try_download(PATH, PEER_FILE, PEER_URL, (FILE_RELOAD * 86400))
-    logging.info(result)
-
-    result = try_download(PATH, SUBSCRIBER_FILE, SUBSCRIBER_URL, (FILE_RELOAD * 86400))
-    logging.info(result)
-
-    # Make Alias Dictionaries
-    peer_ids = mk_full_id_dict(PATH, PEER_FILE, 'peer')
-    if peer_ids:
-        logging.info('ID ALIAS MAPPER: peer_ids dictionary is available')
-
-    subscriber_ids = mk_full_id_dict(PATH, SUBSCRIBER_FILE, 'subscriber')
-    if subscriber_ids:
-        logging.info('ID ALIAS MAPPER: subscriber_ids dictionary is available')
-
-    talkgroup_ids = mk_full_id_dict(PATH, TGID_FILE, 'tgid')
-    if talkgroup_ids:
-        logging.info('ID ALIAS MAPPER: talkgroup_ids dictionary is available')
-
-    local_subscriber_ids = mk_full_id_dict(PATH, LOCAL_SUB_FILE, 'subscriber')
-    if local_subscriber_ids:
-        logging.info('ID ALIAS MAPPER: local_subscriber_ids added to subscriber_ids dictionary')
-        subscriber_ids.update(local_subscriber_ids)
-
-    local_peer_ids = mk_full_id_dict(PATH, LOCAL_PEER_FILE, 'peer')
-    if local_peer_ids:
-        logging.info('ID ALIAS MAPPER: local_peer_ids added peer_ids dictionary')
-        peer_ids.update(local_peer_ids)
+    # Download alias files, make the alias dictionaries and the subscriber search index
+    set_aliases(load_aliases())
+    # Files are downloaded again once they are FILE_RELOAD days old, check daily
+    aliases = task.LoopingCall(refresh_aliases)
+    aliases.start(86400, now=False)
 
     # Jinja2 Stuff
-    env = Environment(
-        loader=PackageLoader('monitor', 'templates'),
-        autoescape=select_autoescape(['html', 'xml'])
-    )
+    env = mk_env()
 
-    dtemplate = env.get_template('hblink_table.html')
-    btemplate = env.get_template('bridge_table.html')
+    # Render the tables in worker processes, spawned so they don't inherit the reactor's threads
+    if RENDER_WORKERS > 0:
+        RENDER_POOL = ProcessPoolExecutor(RENDER_WORKERS, mp_context=get_context('spawn'), initializer=render_init)
+        reactor.addSystemEventTrigger('after', 'shutdown', RENDER_POOL.shutdown, wait=False, cancel_futures=True)
 
     # Create Static Website index file
     index_html = get_template(PATH + 'index_template.html')
     index_html = index_html.replace('<<<system_name>>>', REPORT_NAME)
+    index_html = index_html.replace('<<<dashboard_port>>>', str(DASHBOARD_PORT))
     if CLIENT_TIMEOUT > 0:
         index_html = index_html.replace('<<<timeout_warning>>>', 'Continuous connections not allowed. Connections time out in {} seconds'.format(CLIENT_TIMEOUT))
     else:
         index_html = index_html.replace('<<<timeout_warning>>>', '')
 
+    # Keep a history of every peer's link health
+    if LINK_HISTORY:
+        HEALTH = linkHistory(LINK_HISTORY_RAW, LINK_HISTORY_MINUTES, LINK_HISTORY_HOURS)
+
+    # Warm start from the last saved state and keep saving it
+    if SNAPSHOT_INTERVAL > 0:
+        load_snapshot()
+        snapshot = task.LoopingCall(save_snapshot)
+        snapshot.start(SNAPSHOT_INTERVAL, now=False)
+        reactor.addSystemEventTrigger('before', 'shutdown', save_snapshot)
+
     # Start update loop
     update_stats = task.LoopingCall(build_stats)
     update_stats.start(FREQUENCY)
@@ -896,13 +1769,17 @@ if __name__ == '__main__':
         timeout = task.LoopingCall(timeout_clients)
         timeout.start(10)
 
-    # Connect to HBlink
-    reactor.connectTCP(HBLINK_IP, HBLINK_PORT, reportClientFactory())
+    # Connect to HBlink, or mirror an upstream monitor in relay mode
+    if RELAY_URL:
+        logging.info('Relay mode, mirroring the upstream monitor at %s', RELAY_URL)
+        connectWS(relayClientFactory(RELAY_URL.rstrip('/')))
+    else:
+        reactor.connectTCP(HBLINK_IP, HBLINK_PORT, reportClientFactory())
 
     # Create websocket server to push content to clients
-    dashboard_server = dashboardFactory('ws://*:9000')
+    dashboard_server = dashboardFactory('ws://*:{}'.format(DASHBOARD_PORT))
     dashboard_server.protocol = dashboard
-    reactor.listenTCP(9000, dashboard_server)
+    reactor.listenTCP(DASHBOARD_PORT, dashboard_server)
 
     # Create static web server to push initial index.html
     website = Site(web_server())
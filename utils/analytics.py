@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+#
+###############################################################################
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+#
+#   Offline call history reports from the lastheard.log written by monitor.py
+#
+#   The log (and its rotations, plain or .gz) is read in chunks of rows that
+#   are turned into numpy columns and folded into running aggregates, so
+#   memory depends on the number of groups reported, not on the history size.
+#   Needs numpy: pip3 install numpy
+#
+#   Airtime per talkgroup per hour last month:
+#   python3 utils/analytics.py airtime --by tg --per hour --since 2026-09-01 --until 2026-10-01 log/lastheard.log*
+#
+#   Busiest repeaters, call length and time of day histograms:
+#   python3 utils/analytics.py top --by peer --top 20 --format json log/lastheard.log*
+#   python3 utils/analytics.py histogram --of duration --bins 0,5,10,30,60,120,300 log/lastheard.log*
+#   python3 utils/analytics.py histogram --of hour --where tg=91 log/lastheard.log*
+#
+###############################################################################
+
+import argparse
+import csv
+import gzip
+import json
+import sys
+from itertools import islice
+
+try:
+    import numpy as np
+except ImportError:
+    sys.exit('analytics.py needs numpy: pip3 install numpy')
+
+# Columns of a lastheard.log line, see process_message() in monitor.py:
+# time, duration, call type, action, system, peer id, peer callsign, TS<n>, TG<n>, TG name, subscriber id, subscriber name
+# The names may contain commas, the columns up to the TG name can be relied on.
+KEYS = ('tg', 'peer', 'sub', 'system', 'ts')
+PERIODS = {'hour': 'datetime64[h]', 'day': 'datetime64[D]', 'month': 'datetime64[M]'}
+
+# Columns read into arrays, the names are only looked up in the line when an id is first seen
+COLUMNS = [('time', 'S19'), ('duration', 'f8'), ('system', 'U32'), ('peer', 'i8'),
+           ('ts', 'S3'), ('tg', 'S12'), ('col10', 'U24'), ('col11', 'U24')]
+USECOLS = (0, 1, 4, 5, 7, 8, 10, 11)
+
+def open_log(_name):
+    if _name.endswith('.gz'):
+        return gzip.open(_name, 'rt', encoding='utf-8', errors='replace')
+    return open(_name, 'r', encoding='utf-8', errors='replace')
+
+def read_chunks(_files, _size):
+    for _name in _files:
+        with open_log(_name) as _file:
+            while True:
+                # monitor.py can leave NUL bytes behind in the log
+                _lines = [_line.replace('\0', '') for _line in islice(_file, _size)]
+                if not _lines:
+                    break
+                yield _lines
+
+def sub_column(_row):
+    # First all digit column after the TG name, earlier names may have been split on commas
+    for _col in range(10, len(_row)):
+        if _row[_col].isdigit():
+            return _col
+    return None
+
+def names(_line):
+    # Peer, TG and subscriber names of a line
+    _row = next(csv.reader([_line]))
+    _sub = sub_column(_row)
+    return {'peer': _row[6].strip(), 'tg': ','.join(_row[9:_sub]).strip(), 'sub': ','.join(_row[_sub+1:]).strip()}
+
+def repair(_lines):
+    # Slow path for a chunk numpy could not read, keeps only the lines that look whole
+    _good = []
+    for _line, _row in zip(_lines, csv.reader(_lines)):
+        if len(_row) < 12 or not _row[5].isdigit() or not _row[7][2:].isdigit() or not _row[8][2:].isdigit():
+            continue
+        _sub = sub_column(_row)
+        if _sub is None:
+            continue
+        try:
+            float(_row[1])
+            np.datetime64(_row[0][:19])
+        except ValueError:
+            continue
+        _good.append(_line)
+    return _good
+
+class callHistory(object):
+    # Turns chunks of lines into columns, keeping the names seen for every key
+    def __init__(self):
+        self.names = {_key: {} for _key in KEYS}
+        self.systems = {}
+        self.system_names = []
+        self.dropped = 0
+
+    def parse(self, _lines):
+        _table = np.loadtxt(_lines, delimiter=',', usecols=USECOLS, dtype=COLUMNS, comments=None, quotechar=None, ndmin=1)
+        return _table, _table['time'].astype('datetime64[s]'), np.char.lstrip(_table['ts'], b'TS').astype(np.int64), np.char.lstrip(_table['tg'], b'TG').astype(np.int64)
+
+    def columns(self, _lines):
+        try:
+            _table, _time, _ts, _tg = self.parse(_lines)
+        except ValueError:
+            _good = repair(_lines)
+            self.dropped += len(_lines) - len(_good)
+            if not _good:
+                return None
+            _table, _time, _ts, _tg = self.parse(_good)
+            _lines = _good
+
+        # The subscriber id moves right when the TG name had a comma
+        _sub = np.where(np.char.isdigit(_table['col10']), _table['col10'], _table['col11'])
+        _readable = np.char.isdigit(_sub)
+        if not _readable.all():
+            self.dropped += int((~_readable).sum())
+            _table, _time, _ts, _tg, _sub = (_column[_readable] for _column in (_table, _time, _ts, _tg, _sub))
+            if not len(_table):
+                return None
+            _lines = [_lines[_i] for _i in np.flatnonzero(_readable).tolist()]
+
+        _systems, _system = np.unique(_table['system'], return_inverse=True)
+        _codes = np.array([self.system(_name) for _name in _systems.tolist()], dtype=np.int64)
+        _cols = {
+            'time': _time,
+            'duration': _table['duration'],
+            'system': _codes[_system.ravel()],
+            'peer': _table['peer'],
+            'ts': _ts,
+            'tg': _tg,
+            'sub': _sub.astype(np.int64),
+            }
+        for _key in ('peer', 'tg', 'sub'):
+            self.remember(_key, _cols[_key], _lines)
+        return _cols
+
+    def system(self, _name):
+        if _name not in self.systems:
+            self.systems[_name] = len(self.system_names)
+            self.system_names.append(_name)
+        return self.systems[_name]
+
+    def remember(self, _key, _ids, _lines):
+        # Names from the first line of every id not seen before
+        _ids, _first = np.unique(_ids, return_index=True)
+        _known = self.names[_key]
+        for _id, _i in zip(_ids.tolist(), _first.tolist()):
+            if _id not in _known:
+                _known[_id] = names(_lines[_i])[_key]
+
+    def label(self, _key, _id):
+        if _key == 'system':
+            return self.system_names[_id]
+        return self.names[_key].get(_id, '')
+
+def select(_cols, _args):
+    _mask = np.ones(len(_cols['time']), dtype=bool)
+    if _args.since:
+        _mask &= _cols['time'] >= np.datetime64(_args.since)
+    if _args.until:
+        _mask &= _cols['time'] < np.datetime64(_args.until)
+    for _key, _value in _args.where:
+        _mask &= _cols[_key] == _value
+    if _mask.all():
+        return _cols
+    return {_col: _values[_mask] for _col, _values in _cols.items()}
+
+class groupTotals(object):
+    # Calls and airtime per (key, period) as arrays, merged chunk by chunk.
+    # Both go into one int64, ids take up to 32 bits and periods (hours since 1970 at most) 22.
+    PERIOD_BITS = 22
+
+    def __init__(self):
+        self.groups = np.zeros(0, dtype=np.int64)
+        self.calls = np.zeros(0)
+        self.airtime = np.zeros(0)
+
+    def add(self, _keys, _periods, _duration):
+        _groups, _inverse = np.unique(np.concatenate((self.groups, (_keys << self.PERIOD_BITS) | _periods)), return_inverse=True)
+        self.calls = np.bincount(_inverse, weights=np.concatenate((self.calls, np.ones(len(_keys)))), minlength=len(_groups))
+        self.airtime = np.bincount(_inverse, weights=np.concatenate((self.airtime, _duration)), minlength=len(_groups))
+        self.groups = _groups
+
+    def keys(self):
+        return self.groups >> self.PERIOD_BITS
+
+    def periods(self):
+        return self.groups & ((1 << self.PERIOD_BITS) - 1)
+
+def totals(_chunks, _by, _per):
+    _totals = groupTotals()
+    for _cols in _chunks:
+        if _per:
+            _periods = _cols['time'].astype(PERIODS[_per]).astype(np.int64)
+        else:
+            _periods = np.zeros(len(_cols['time']), dtype=np.int64)
+        _totals.add(_cols[_by], _periods, _cols['duration'])
+    return _totals
+
+def report_lines(_history, _totals, _order, _args):
+    _keys, _periods = _totals.keys()[_order].tolist(), _totals.periods()[_order]
+    if _args.per:
+        _periods = _periods.astype(PERIODS[_args.per]).astype(str)
+    for _key, _period, _calls, _airtime in zip(_keys, _periods.tolist(), _totals.calls[_order].tolist(), _totals.airtime[_order].tolist()):
+        if _args.by == 'system':
+            _line = {'SYSTEM': _history.label('system', _key)}
+        else:
+            _line = {_args.by.upper(): _key, 'NAME': _history.label(_args.by, _key)}
+        if _args.per:
+            _line['PERIOD'] = _period
+        _line['CALLS'] = int(_calls)
+        _line['AIRTIME'] = round(_airtime, 1)
+        yield _line
+
+def airtime_report(_history, _chunks, _args):
+    _totals = totals(_chunks, _args.by, _args.per)
+    return report_lines(_history, _totals, np.lexsort((_totals.keys(), _totals.periods())), _args)
+
+def top_report(_history, _chunks, _args):
+    _args.per = None
+    _totals = totals(_chunks, _args.by, None)
+    _sort = _totals.airtime if _args.sort == 'airtime' else _totals.calls
+    if len(_sort) > _args.top:
+        _best = np.argpartition(-_sort, _args.top - 1)[:_args.top]
+    else:
+        _best = np.arange(len(_sort))
+    _best = _best[np.argsort(-_sort[_best], kind='stable')]
+    return report_lines(_history, _totals, _best, _args)
+
+def histogram_report(_history, _chunks, _args):
+    if _args.of == 'duration':
+        _edges = np.array([float(_edge) for _edge in _args.bins.split(',')] + [np.inf])
+        _counts = np.zeros(len(_edges) - 1, dtype=np.int64)
+        _airtime = np.zeros(len(_edges) - 1)
+        for _cols in _chunks:
+            _counts += np.histogram(_cols['duration'], _edges)[0]
+            _airtime += np.histogram(_cols['duration'], _edges, weights=_cols['duration'])[0]
+        _labels = ['{:g}-{:g}'.format(_low, _high) for _low, _high in zip(_edges[:-1], _edges[1:])]
+    else:
+        _size = 24 if _args.of == 'hour' else 7
+        _counts = np.zeros(_size, dtype=np.int64)
+        _airtime = np.zeros(_size)
+        for _cols in _chunks:
+            if _args.of == 'hour':
+                _bins = _cols['time'].astype('datetime64[h]').astype(np.int64) % 24
+            else:
+                # 1970-01-01 was a Thursday, 0 is Monday
+                _bins = (_cols['time'].astype('datetime64[D]').astype(np.int64) + 3) % 7
+            _counts += np.bincount(_bins, minlength=_size)
+            _airtime += np.bincount(_bins, weights=_cols['duration'], minlength=_size)
+        if _args.of == 'hour':
+            _labels = ['{:02d}'.format(_hour) for _hour in range(24)]
+        else:
+            _labels = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+    return [{_args.of.upper(): _label, 'CALLS': _n, 'AIRTIME': round(_seconds, 1)}
+            for _label, _n, _seconds in zip(_labels, _counts.tolist(), _airtime.tolist())]
+
+def write_report(_report, _format, _output):
+    # Lines are written as they are made, a report can have as many as the history has calls
+    if _format == 'json':
+        _output.write('[')
+        for _n, _line in enumerate(_report):
+            _output.write(',\n ' if _n else '\n ')
+            _output.write(json.dumps(_line))
+        _output.write('\n]\n')
+        return
+    _writer = csv.writer(_output)
+    for _n, _line in enumerate(_report):
+        if not _n:
+            _writer.writerow(list(_line))
+        _writer.writerow(list(_line.values()))
+
+def where(_arg):
+    _key, _sep, _value = _arg.partition('=')
+    if _key not in KEYS or _key == 'system' or not _value.isdigit():
+        raise argparse.ArgumentTypeError('expected tg=, peer=, sub= or ts= with a number, not {}'.format(_arg))
+    return _key, int(_value)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Call history reports from lastheard.log')
+    parser.add_argument('report', choices=('airtime', 'top', 'histogram'))
+    parser.add_argument('files', nargs='+', help='lastheard.log and its rotations, .gz is fine')
+    parser.add_argument('--by', choices=KEYS, default='tg', help='group airtime and top reports by (tg)')
+    parser.add_argument('--per', choices=tuple(PERIODS), help='split the airtime report by period')
+    parser.add_argument('--top', type=int, default=10, help='lines of the top report (10)')
+    parser.add_argument('--sort', choices=('airtime', 'calls'), default='airtime', help='what the top report ranks (airtime)')
+    parser.add_argument('--of', choices=('duration', 'hour', 'weekday'), default='duration', help='what the histogram counts (duration)')
+    parser.add_argument('--bins', default='0,5,10,30,60,120,300', help='duration histogram bin edges in seconds')
+    parser.add_argument('--since', help='first day or time to include, e.g. 2026-09-01')
+    parser.add_argument('--until', help='first day or time to leave out')
+    parser.add_argument('--where', type=where, action='append', default=[], help='only calls with e.g. tg=91, may be repeated')
+    parser.add_argument('--format', choices=('csv', 'json'), default='csv')
+    parser.add_argument('--output', help='file to write, stdout if not given')
+    parser.add_argument('--chunk', type=int, default=100000, help='rows read at a time (100000)')
+    args = parser.parse_args()
+
+    history = callHistory()
+    chunks = (select(_cols, args) for _cols in map(history.columns, read_chunks(args.files, args.chunk)) if _cols is not None)
+    report = {'airtime': airtime_report, 'top': top_report, 'histogram': histogram_report}[args.report](history, chunks, args)
+
+    if args.output:
+        with open(args.output, 'w', newline='') as output:
+            write_report(report, args.format, output)
+    else:
+        write_report(report, args.format, sys.stdout)
+    if history.dropped:
+        print('{} unreadable lines skipped'.format(history.dropped), file=sys.stderr)
@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+#
+###############################################################################
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+#
+#   Websocket fan-out load test for monitor.py
+#
+#   Plays a synthetic HBlink on the reporting port and opens N dashboard
+#   clients, some of them slow readers. Point HBLINK_IP/HBLINK_PORT in the
+#   monitor's config.py at this tool, then either start the monitor yourself
+#   and pass --pid, or let the tool start it with --monitor <directory>.
+#
+#   python3 utils/loadtest.py --clients 200 --slow 0.1 --rate 20 --duration 120 --monitor . --report 1.1.json
+#
+#   Event latency is measured from the BRDG_EVENT written to the monitor to
+#   the log frame carrying it arriving at each client, the subscriber id of
+#   every synthetic call is unique so frames can be matched to events.
+#
+###############################################################################
+
+import argparse
+import json
+import os
+import re
+import sys
+import subprocess
+from pickle import dumps
+from random import Random
+from time import time, strftime, localtime
+
+from twisted.internet import reactor, task
+from twisted.internet.protocol import ServerFactory
+from twisted.protocols.basic import NetstringReceiver
+
+from autobahn.twisted.websocket import WebSocketClientProtocol, WebSocketClientFactory, connectWS
+
+# Matches the log frames built by monitor.py process_message()
+SUB_ID = re.compile(r'SUB: (\d+)')
+# First synthetic subscriber id, each call gets the next one
+FIRST_SUB = 100000000
+
+OPCODE = {
+    'CONFIG_SND': b'\x01',
+    'BRIDGE_SND': b'\x03',
+    'BRDG_EVENT': b'\x07',
+    }
+
+def bytes_4(_int_id):
+    return _int_id.to_bytes(4, 'big')
+
+def percentile(_values, _pct):
+    if not _values:
+        return None
+    _values = sorted(_values)
+    return _values[min(len(_values) - 1, int(round(_pct / 100.0 * (len(_values) - 1))))]
+
+def summary(_values, _scale=1):
+    return {
+        'count': len(_values),
+        'p50': None if not _values else round(percentile(_values, 50) * _scale, 3),
+        'p99': None if not _values else round(percentile(_values, 99) * _scale, 3),
+        'max': None if not _values else round(max(_values) * _scale, 3),
+        'mean': None if not _values else round(sum(_values) / len(_values) * _scale, 3),
+        }
+
+######################################################################
+#
+# SYNTHETIC HBlink: CONFIG_SND, BRIDGE_SND AND GROUP VOICE CALLS
+#
+
+def mk_config(_masters, _peers):
+    _now = time()
+    _config = {}
+    _peer_id = 3100001
+    for _master in range(_masters):
+        _peers_conf = {}
+        for _peer in range(_peers):
+            _peers_conf[bytes_4(_peer_id)] = {
+                'CONNECTION': 'YES', 'CONNECTED': _now, 'IP': '127.0.0.1', 'PORT': 62031,
+                'TX_FREQ': b'438500000', 'RX_FREQ': b'431000000', 'SLOTS': b'3',
+                'PACKAGE_ID': b'MMDVM', 'SOFTWARE_ID': b'loadtest', 'LOCATION': b'Load test',
+                'CALLSIGN': 'LT{}'.format(_peer_id).encode('utf-8'), 'COLORCODE': b'1',
+                'PINGS_RECEIVED': 0, 'LAST_PING': _now,
+                }
+            _peer_id += 1
+        _config['MASTER-{}'.format(_master)] = {'ENABLED': True, 'MODE': 'MASTER', 'REPEAT': True, 'PEERS': _peers_conf}
+    return _config
+
+def mk_bridges(_masters):
+    _bridges = {}
+    for _master in range(_masters):
+        _bridges['TG{}'.format(_master + 1)] = [{
+            'SYSTEM': 'MASTER-{}'.format(_master), 'TS': 2, 'TGID': bytes_4(_master + 1), 'ACTIVE': True,
+            'TIMEOUT': 900, 'TO_TYPE': 'NONE', 'ON': [], 'OFF': [], 'RESET': [], 'TIMER': time(),
+            }]
+    return _bridges
+
+class hblink(NetstringReceiver):
+    MAX_LENGTH = 500000
+
+    def connectionMade(self):
+        print('monitor connected to the synthetic HBlink')
+        self.factory.monitor = self
+        self.sendString(OPCODE['CONFIG_SND'] + dumps(self.factory.config))
+        self.sendString(OPCODE['BRIDGE_SND'] + dumps(self.factory.bridges))
+
+    def connectionLost(self, reason):
+        print('monitor disconnected from the synthetic HBlink')
+        self.factory.monitor = None
+
+    def stringReceived(self, data):
+        pass
+
+class hblinkFactory(ServerFactory):
+    protocol = hblink
+
+    def __init__(self, args):
+        self.args = args
+        self.random = Random(args.seed)
+        self.config = mk_config(args.masters, args.peers)
+        self.bridges = mk_bridges(args.masters)
+        self.monitor = None
+        self.sub = FIRST_SUB
+        self.sent = {}
+
+    def send_config(self):
+        if self.monitor:
+            self.monitor.sendString(OPCODE['CONFIG_SND'] + dumps(self.config))
+
+    def call(self):
+        # One call: START now, END a few seconds later, both with a fresh subscriber id
+        if not self.monitor:
+            return
+        _system = self.random.randrange(self.args.masters)
+        _peer = 3100001 + _system * self.args.peers + self.random.randrange(self.args.peers)
+        _slot = self.random.choice((1, 2))
+        _tgid = _system + 1
+        _duration = self.random.uniform(1, 2 * self.args.call_seconds)
+        _fields = ['GROUP VOICE', 'START', 'RX', 'MASTER-{}'.format(_system), str(self.sub), str(_peer), str(self.sub), str(_slot), str(_tgid)]
+        self.send_event(self.sub, _fields)
+        reactor.callLater(_duration, self.end, self.sub + 1, _fields, _duration)
+        self.sub += 2
+
+    def end(self, _sub, _fields, _duration):
+        if not self.monitor:
+            return
+        _fields = list(_fields)
+        _fields[1] = 'END'
+        _fields[6] = str(_sub)
+        self.send_event(_sub, _fields + [str(round(_duration, 2))])
+
+    def send_event(self, _sub, _fields):
+        self.sent[_sub] = time()
+        self.monitor.sendString(OPCODE['BRDG_EVENT'] + ','.join(_fields).encode('utf-8'))
+
+######################################################################
+#
+# SIMULATED BROWSERS
+#
+
+class browser(WebSocketClientProtocol):
+
+    def onOpen(self):
+        self.stats = self.factory.stats
+        self.stats['CONNECTED'] = time()
+        self.hello = None
+        if self.stats['SLOW']:
+            # A slow reader stops reading for a while, over and over
+            self.pause = task.LoopingCall(self.stall)
+            self.pause.start(self.factory.args.slow_every, now=False)
+
+    def stall(self):
+        self.transport.pauseProducing()
+        reactor.callLater(self.factory.args.slow_pause, self.transport.resumeProducing)
+
+    def onMessage(self, payload, isBinary):
+        _now = time()
+        self.stats['FRAMES'] += 1
+        self.stats['BYTES'] += len(payload)
+        _frame = payload.decode('utf-8', 'ignore')
+        _sep = _frame.find(',')
+        _opcode = _frame[:1]
+        _seq = int(_frame[1:_sep])
+        if _opcode == 'h':
+            self.hello = _seq
+        # The snapshot backlog shares the hello's sequence number, it is not new traffic
+        elif _opcode == 'l' and self.hello is not None and _seq > self.hello:
+            for _sub in SUB_ID.findall(_frame):
+                _sent = self.factory.hblink.sent.get(int(_sub))
+                if _sent is not None:
+                    self.stats['LATENCY'].append(_now - _sent)
+
+    def onClose(self, wasClean, code, reason):
+        if getattr(self, 'pause', None) and self.pause.running:
+            self.pause.stop()
+        if not self.factory.stopping:
+            self.stats['DROPPED'] = True
+            self.stats['CLOSE'] = '{} {}'.format(code, reason)
+
+def open_browser(_args, _hblink, _stopping, _slow):
+    _stats = {'SLOW': _slow, 'CONNECTED': None, 'FRAMES': 0, 'BYTES': 0, 'LATENCY': [], 'DROPPED': False, 'CLOSE': None}
+    _factory = WebSocketClientFactory(_args.url)
+    _factory.protocol = browser
+    _factory.args = _args
+    _factory.hblink = _hblink
+    _factory.stats = _stats
+    _factory.stopping = _stopping
+    connectWS(_factory)
+    return _factory
+
+######################################################################
+#
+# SERVER CPU AND RSS FROM /proc, INCLUDING CHILD PROCESSES (RENDER WORKERS)
+#
+
+def proc_tree(_pid):
+    _children = {}
+    for _entry in os.listdir('/proc'):
+        if _entry.isdigit():
+            try:
+                with open('/proc/{}/stat'.format(_entry)) as _stat:
+                    _ppid = int(_stat.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            _children.setdefault(_ppid, []).append(int(_entry))
+    _tree = [_pid]
+    for _proc in _tree:
+        _tree.extend(_children.get(_proc, []))
+    return _tree
+
+def proc_usage(_pid):
+    # CPU seconds and RSS bytes of a process and its children
+    _ticks = os.sysconf('SC_CLK_TCK')
+    _cpu = 0.0
+    _rss = 0
+    for _proc in proc_tree(_pid):
+        try:
+            with open('/proc/{}/stat'.format(_proc)) as _stat:
+                _fields = _stat.read().rsplit(')', 1)[1].split()
+            _cpu += (int(_fields[11]) + int(_fields[12])) / _ticks
+            _rss += int(_fields[21]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, IndexError, ValueError):
+            continue
+    return _cpu, _rss
+
+class sampler(object):
+    def __init__(self, _pid):
+        self.pid = _pid
+        self.samples = []
+        self.last = None
+
+    def sample(self):
+        _now = time()
+        _cpu, _rss = proc_usage(self.pid)
+        if self.last:
+            _load = (_cpu - self.last[1]) / (_now - self.last[0]) * 100
+            self.samples.append({'t': round(_now - self.start, 1), 'cpu_pct': round(_load, 1), 'rss_mb': round(_rss / 1048576.0, 1)})
+        else:
+            self.start = _now
+        self.last = (_now, _cpu)
+
+######################################################################
+#
+# REPORT
+#
+
+def git_version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def mk_report(_args, _browsers, _sampler, _hblink, _started):
+    _fast = [_b.stats for _b in _browsers if not _b.stats['SLOW']]
+    _slow = [_b.stats for _b in _browsers if _b.stats['SLOW']]
+    _report = {
+        'version': git_version(),
+        'started': strftime('%Y-%m-%d %H:%M:%S', localtime(_started)),
+        'params': {
+            'clients': _args.clients, 'slow': _args.slow, 'rate': _args.rate, 'duration': _args.duration,
+            'masters': _args.masters, 'peers': _args.peers, 'call_seconds': _args.call_seconds,
+            },
+        'events_sent': len(_hblink.sent),
+        'clients': {
+            'connected': sum(1 for _b in _browsers if _b.stats['CONNECTED']),
+            'dropped': sum(1 for _b in _browsers if _b.stats['DROPPED']),
+            'close_reasons': sorted(set(_b.stats['CLOSE'] for _b in _browsers if _b.stats['CLOSE'])),
+            },
+        'latency_ms': summary([_l for _s in _fast for _l in _s['LATENCY']], 1000),
+        'latency_slow_ms': summary([_l for _s in _slow for _l in _s['LATENCY']], 1000),
+        'frames_per_client': summary([_b.stats['FRAMES'] for _b in _browsers]),
+        'bytes_per_client': summary([_b.stats['BYTES'] for _b in _browsers]),
+        }
+    if _sampler:
+        _report['server'] = {
+            'cpu_pct': summary([_s['cpu_pct'] for _s in _sampler.samples]),
+            'rss_mb': summary([_s['rss_mb'] for _s in _sampler.samples]),
+            'samples': _sampler.samples,
+            }
+    return _report
+
+######################################################################
+#
+# MAIN
+#
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Websocket fan-out load test for monitor.py')
+    parser.add_argument('--url', default='ws://127.0.0.1:9000', help='dashboard websocket of the monitor under test')
+    parser.add_argument('--hblink-port', type=int, default=4321, help='port of the synthetic HBlink reporting socket')
+    parser.add_argument('--clients', type=int, default=50, help='number of simulated browsers')
+    parser.add_argument('--ramp', type=float, default=5.0, help='seconds over which the browsers connect')
+    parser.add_argument('--slow', type=float, default=0.1, help='fraction of browsers that are slow readers')
+    parser.add_argument('--slow-every', type=float, default=2.0, help='seconds between stalls of a slow reader')
+    parser.add_argument('--slow-pause', type=float, default=1.0, help='seconds a slow reader stops reading')
+    parser.add_argument('--rate', type=float, default=5.0, help='calls started per second')
+    parser.add_argument('--call-seconds', type=float, default=3.0, help='mean call length')
+    parser.add_argument('--masters', type=int, default=10, help='master systems in the synthetic config')
+    parser.add_argument('--peers', type=int, default=20, help='peers per master system')
+    parser.add_argument('--config-every', type=float, default=10.0, help='seconds between CONFIG_SND')
+    parser.add_argument('--duration', type=float, default=60.0, help='seconds to run after the ramp')
+    parser.add_argument('--seed', type=int, default=1, help='random seed, keep it fixed to compare releases')
+    parser.add_argument('--pid', type=int, help='pid of a running monitor to sample CPU and RSS from')
+    parser.add_argument('--monitor', help='directory with monitor.py and its config.py, started and stopped by this tool')
+    parser.add_argument('--report', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    hblink_factory = hblinkFactory(args)
+    reactor.listenTCP(args.hblink_port, hblink_factory)
+
+    monitor = None
+    pid = args.pid
+    if args.monitor:
+        monitor = subprocess.Popen([sys.executable, 'monitor.py'], cwd=args.monitor, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        pid = monitor.pid
+
+    usage = None
+    if pid:
+        usage = sampler(pid)
+        task.LoopingCall(usage.sample).start(1.0)
+
+    stopping = []
+    browsers = []
+    for n in range(args.clients):
+        reactor.callLater(2 + args.ramp * n / max(1, args.clients), lambda n=n: browsers.append(open_browser(args, hblink_factory, stopping, n < args.clients * args.slow)))
+
+    task.LoopingCall(hblink_factory.send_config).start(args.config_every, now=False)
+    calls = task.LoopingCall(hblink_factory.call)
+    reactor.callLater(2 + args.ramp, calls.start, 1.0 / args.rate)
+
+    started = time()
+
+    def finish():
+        stopping.append(True)
+        report = json.dumps(mk_report(args, browsers, usage, hblink_factory, started), indent=2)
+        if args.report:
+            with open(args.report, 'w') as _file:
+                _file.write(report + '\n')
+            print('report written to {}'.format(args.report))
+        else:
+            print(report)
+        if monitor:
+            monitor.terminate()
+        reactor.stop()
+
+    # Stop the calls, then give the last frames a few seconds to arrive
+    reactor.callLater(2 + args.ramp + args.duration, lambda: calls.running and calls.stop())
+    reactor.callLater(2 + args.ramp + args.duration + 5, finish)
+    reactor.run()